@@ -0,0 +1,472 @@
+import multiprocessing
+
+import numpy
+
+from dartqc.DartUtils import stamp
+
+# Two-bit encoding of nucleotides for k-mers, other characters (e.g. N) invalidate the k-mer:
+NUCLEOTIDES = numpy.full(256, 255, dtype=numpy.uint8)
+for _code, _bases in enumerate(("Aa", "Cc", "Gg", "Tt")):
+    for _base in _bases:
+        NUCLEOTIDES[ord(_base)] = _code
+
+COMPLEMENTS = str.maketrans("ACGTacgt", "TGCAtgca")
+
+# Worker processes are spawned rather than forked, as pools may be started while other threads are running (e.g.
+# clustering in the background of the filter pipeline) and a forked child can deadlock on locks held by these threads:
+POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+_sequences = []  # Sequences for verification in worker processes
+_index = None  # Index of reference sequences for matching in worker processes
+
+
+class KmerClusterer:
+
+    """
+    In-process clustering of short allele sequences at nucleotide identity, alternative to CD-HIT-EST.
+
+    Candidate pairs of sequences are found with MinHash sketches of k-mers and locality-sensitive hashing (sequences
+    are candidates if their sketches agree in all rows of at least one band). Candidates are verified exactly with a
+    bit-parallel edit distance (Myers, 1999) of the shorter sequence against the longer sequence, where identity is
+    the proportion of the shorter sequence without edits. Verified pairs are linked into clusters (single linkage),
+    so that clusters do not depend on input order or the number of processes, unlike the greedy incremental
+    clustering of CD-HIT.
+
+    """
+
+    def __init__(self, identity=0.95, kmer_size=7, bands=64, rows=3, threads=1, seed=20170101, block_size=256):
+
+        self.identity = identity
+        self.kmer_size = kmer_size
+        self.bands = bands
+        self.rows = rows
+        self.threads = threads
+        self.seed = seed
+        self.block_size = block_size
+
+        random_state = numpy.random.RandomState(seed)
+
+        # Odd multipliers and offsets for universal hashing of k-mers with 64-bit overflow:
+        n_hashes = bands * rows
+        self.multipliers = random_state.randint(1, 2 ** 62, size=n_hashes, dtype=numpy.int64).astype(numpy.uint64) \
+            * numpy.uint64(2) + numpy.uint64(1)
+        self.offsets = random_state.randint(0, 2 ** 62, size=n_hashes, dtype=numpy.int64).astype(numpy.uint64)
+
+    def cluster(self, sequences):
+
+        """
+        Cluster sequences (dictionary of ID: sequence), returns dictionary of clusters with more than one member in
+        the format of RedundancyModule: {cluster_id: [ids]}, members in input order.
+
+        """
+
+        ids = list(sequences.keys())
+        seqs = [sequences[i] for i in ids]
+
+        stamp("Sketching", len(seqs), "sequences with", self.bands * self.rows, "hashes of", str(self.kmer_size) +
+              "-mers")
+
+        sketches = self._sketch(seqs)
+
+        candidates = self._get_candidates(sketches, seqs)
+
+        stamp("Verifying", len(candidates), "candidate pairs at identity", self.identity)
+
+        verified = self._verify(candidates, seqs)
+
+        stamp("Linking", len(verified), "pairs of sequences into clusters")
+
+        return self._link(ids, verified)
+
+    def _sketch(self, seqs):
+
+        """ MinHash sketch (sequences x hashes) of the k-mers of each sequence. """
+
+        n_hashes = len(self.multipliers)
+        sketches = numpy.full((len(seqs), n_hashes), numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+
+        for start in range(0, len(seqs), self.block_size):
+            kmers, valid = get_kmers(seqs[start:start + self.block_size], self.kmer_size)
+
+            if kmers.shape[1] == 0:
+                continue
+
+            with numpy.errstate(over="ignore"):
+                hashes = kmers[:, :, None] * self.multipliers[None, None, :] + self.offsets[None, None, :]
+
+            hashes[~valid] = numpy.iinfo(numpy.uint64).max
+            sketches[start:start + self.block_size] = hashes.min(axis=1)
+
+        return sketches
+
+    def _get_candidates(self, sketches, seqs):
+
+        """
+        Candidate pairs (i, j) with i < j from sequences with identical sketches in all rows of a band, excluding
+        pairs that cannot reach identity because of their difference in length.
+
+        """
+
+        candidates = set()
+        empty = (sketches == numpy.iinfo(numpy.uint64).max).all(axis=1)  # Sequences without valid k-mers
+
+        for band in range(self.bands):
+            rows = sketches[:, band * self.rows:(band + 1) * self.rows]
+
+            order = numpy.lexsort(rows.T[::-1])
+            ordered = rows[order]
+
+            boundaries = numpy.flatnonzero((ordered[1:] != ordered[:-1]).any(axis=1)) + 1
+            for bucket in numpy.split(order, boundaries):
+                if len(bucket) < 2:
+                    continue
+                members = sorted(int(i) for i in bucket if not empty[i])
+                for a, i in enumerate(members):
+                    for j in members[a + 1:]:
+                        candidates.add((i, j))
+
+        lengths = [len(seq) for seq in seqs]
+
+        return sorted((i, j) for i, j in candidates
+                      if abs(lengths[i] - lengths[j]) <= self._get_max_edits(min(lengths[i], lengths[j])))
+
+    def _get_max_edits(self, length):
+
+        return int((1 - self.identity) * length + 1e-9)
+
+    def _verify(self, candidates, seqs):
+
+        """ Verified pairs at identity threshold, candidate pairs are distributed across processes. """
+
+        global _sequences
+        _sequences = seqs
+
+        tasks = [(i, j, self._get_max_edits(min(len(seqs[i]), len(seqs[j])))) for i, j in candidates]
+
+        if self.threads > 1 and len(tasks) > 1:
+            chunk_size = max(1, len(tasks) // (self.threads * 4))
+            with POOL_CONTEXT.Pool(processes=self.threads, initializer=_set_sequences, initargs=(seqs,)) as pool:
+                matches = pool.map(_verify_pair, tasks, chunksize=chunk_size)
+        else:
+            matches = [_verify_pair(task) for task in tasks]
+
+        return [(i, j) for (i, j, _), match in zip(tasks, matches) if match]
+
+    @staticmethod
+    def _link(ids, pairs):
+
+        """ Single linkage of verified pairs with union-find, returns clusters with more than one member. """
+
+        parents = list(range(len(ids)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for i, j in pairs:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parents[max(root_i, root_j)] = min(root_i, root_j)
+
+        members = {}
+        for i in range(len(ids)):
+            members.setdefault(find(i), []).append(ids[i])
+
+        clusters = [cluster for root, cluster in sorted(members.items()) if len(cluster) > 1]
+
+        return {cluster_id: cluster for cluster_id, cluster in enumerate(clusters, 1)}
+
+
+class SequenceIndex:
+
+    """
+    Index of reference sequences for matching query sequences at nucleotide identity, alternative to CD-HIT-EST-2D.
+
+    K-mers of the reference sequences are stored as sorted arrays of encoded k-mers and reference indices, so that the
+    index takes a few bytes for each k-mer instead of Python objects. Queries are looked up by exact sequence first
+    and then by k-mers shared with reference sequences on both strands (as CD-HIT-EST-2D, -r 1). As in CD-HIT-EST-2D
+    with default length cutoffs (-s2 1.0), queries only match reference sequences of at least the same length.
+    Candidates sharing enough k-mers to reach identity are verified by edit distance of the query against the
+    reference, where identity is the proportion of the query without edits. Queries identical to a reference sequence
+    are assigned to it, other queries to the first matching reference in order of the index.
+
+    Queries with fewer than 1 / (1 - identity) bases (e.g. 100 bases at 99% identity) match without edits, i.e. only
+    if they are contained in the reference sequence.
+
+    """
+
+    def __init__(self, sequences, identity=0.99, kmer_size=10, reverse=True, block_size=4096):
+
+        self.identity = identity
+        self.kmer_size = kmer_size
+        self.reverse = reverse
+
+        self.ids = list(sequences.keys())
+        self.seqs = [sequences[i] for i in self.ids]
+        self.lengths = numpy.array([len(seq) for seq in self.seqs], dtype=numpy.int64)
+
+        self.exact = {}
+        for i, seq in enumerate(self.seqs):
+            self.exact.setdefault(seq, i)
+
+        self.kmers, self.refs = self._index_kmers(block_size)
+
+    def _index_kmers(self, block_size=4096):
+
+        """
+        Distinct k-mers of each reference sequence as arrays of encoded k-mers sorted by k-mer and the indices of
+        their reference sequences (in order of the index for each k-mer), built in blocks of sequences. K-mers of up
+        to 16 bases are stored as 32-bit integers.
+
+        """
+
+        bits = numpy.uint64(2 * self.kmer_size)
+
+        keys = []
+        for start in range(0, len(self.seqs), block_size):
+            kmers, valid = get_kmers(self.seqs[start:start + block_size], self.kmer_size)
+
+            refs = numpy.arange(start, start + kmers.shape[0], dtype=numpy.uint64)[:, None]
+            keys.append(numpy.unique(((refs << bits) | kmers)[valid]))
+
+        keys = numpy.concatenate(keys + [numpy.zeros(0, dtype=numpy.uint64)])
+
+        kmers = keys & numpy.uint64((1 << (2 * self.kmer_size)) - 1)
+        order = numpy.argsort(kmers, kind="mergesort")
+
+        kmer_type = numpy.uint32 if self.kmer_size <= 16 else numpy.uint64
+
+        return kmers[order].astype(kmer_type), (keys[order] >> bits).astype(numpy.int32)
+
+    def match(self, queries, threads=1, block_size=256):
+
+        """
+        Match query sequences (dictionary of ID: sequence) against the index in blocks across processes, returns
+        dictionary of query ID: reference ID, or None if no reference sequence matches at identity.
+
+        """
+
+        global _index
+        _index = self
+
+        query_ids = list(queries.keys())
+        seqs = [queries[i] for i in query_ids]
+
+        stamp("Matching", len(seqs), "sequences against", len(self.seqs), "reference sequences at identity",
+              self.identity)
+
+        blocks = [seqs[start:start + block_size] for start in range(0, len(seqs), block_size)]
+
+        if threads > 1 and len(blocks) > 1:
+            with POOL_CONTEXT.Pool(processes=threads, initializer=_set_index, initargs=(self,)) as pool:
+                matches = pool.map(_match_sequences, blocks)
+        else:
+            matches = [self.match_sequences(block) for block in blocks]
+
+        matches = [match for block in matches for match in block]
+
+        return {query_id: (self.ids[match] if match >= 0 else None) for query_id, match in zip(query_ids, matches)}
+
+    def match_sequences(self, seqs):
+
+        """ Indices of first reference sequences matching a block of sequences at identity, -1 if none matches. """
+
+        matches = [-1] * len(seqs)
+
+        # Strands of queries without exact match:
+        queries = []
+        strands = []
+        for query, seq in enumerate(seqs):
+            seq_strands = [seq, reverse_complement(seq)] if self.reverse else [seq]
+
+            for strand in seq_strands:
+                exact = self.exact.get(strand)
+                if exact is not None:
+                    matches[query] = exact
+                    break
+            else:
+                queries += [query] * len(seq_strands)
+                strands += seq_strands
+
+        if not strands:
+            return matches
+
+        max_edits = [int((1 - self.identity) * len(strand) + 1e-9) for strand in strands]
+
+        rows, refs = self._get_candidates(strands, max_edits)
+        queries = numpy.array(queries)[rows]
+
+        matched = set()
+        for i in numpy.lexsort((refs, queries)):
+            query, ref, row = int(queries[i]), int(refs[i]), int(rows[i])
+
+            if query in matched:
+                continue
+
+            if max_edits[row] == 0:
+                match = strands[row] in self.seqs[ref]
+            else:
+                match = edit_distance(strands[row], self.seqs[ref], max_edits[row]) <= max_edits[row]
+
+            if match:
+                matches[query] = ref
+                matched.add(query)
+
+        return matches
+
+    def _get_candidates(self, seqs, max_edits):
+
+        """
+        Candidate pairs of sequences and reference sequences (rows, references) for a block of sequences, candidates
+        are reference sequences at least as long as the sequence that share enough of its distinct k-mers to reach
+        identity: each edit in the sequence removes at most k-mer size of its k-mers from the reference.
+
+        """
+
+        bits = numpy.uint64(2 * self.kmer_size)
+
+        kmers, valid = get_kmers(seqs, self.kmer_size)
+
+        rows = numpy.nonzero(valid)[0].astype(numpy.uint64)
+        keys = numpy.unique((rows << bits) | kmers[valid])
+
+        rows = (keys >> bits).astype(numpy.int64)
+        kmers = (keys & numpy.uint64((1 << (2 * self.kmer_size)) - 1)).astype(self.kmers.dtype)
+
+        distinct = numpy.bincount(rows, minlength=len(seqs))
+
+        # Reference sequences of each k-mer from the ranges of the k-mer in the index:
+        lower = numpy.searchsorted(self.kmers, kmers, side="left")
+        counts = numpy.searchsorted(self.kmers, kmers, side="right") - lower
+
+        rows = numpy.repeat(rows, counts)
+        refs = self.refs[numpy.repeat(lower - numpy.cumsum(counts) + counts, counts) + numpy.arange(counts.sum())]
+
+        pairs, shared = numpy.unique(rows * len(self.seqs) + refs, return_counts=True)
+        rows, refs = pairs // len(self.seqs), pairs % len(self.seqs)
+
+        lengths = numpy.array([len(seq) for seq in seqs])
+        keep = (shared >= distinct[rows] - self.kmer_size * numpy.array(max_edits)[rows]) & \
+               (self.lengths[refs] >= lengths[rows])
+
+        return rows[keep], refs[keep]
+
+
+def get_kmers(seqs, kmer_size):
+
+    """
+    Two-bit encoded k-mers (sequences x positions) of a block of sequences and mask of valid k-mers, k-mers are
+    invalid if they extend beyond the end of the sequence or contain other characters than nucleotides.
+
+    """
+
+    length = max([len(seq) for seq in seqs] + [0])
+
+    codes = numpy.full((len(seqs), length), 255, dtype=numpy.uint8)
+    for i, seq in enumerate(seqs):
+        codes[i, :len(seq)] = NUCLEOTIDES[numpy.frombuffer(seq.encode("ascii"), dtype=numpy.uint8)]
+
+    n_kmers = max(length - kmer_size + 1, 0)
+
+    kmers = numpy.zeros((len(seqs), n_kmers), dtype=numpy.uint64)
+    valid = numpy.ones((len(seqs), n_kmers), dtype=bool)
+
+    for offset in range(kmer_size):
+        window = codes[:, offset:offset + n_kmers]
+        valid &= window != 255
+        kmers = (kmers << numpy.uint64(2)) | (window & 3).astype(numpy.uint64)
+
+    return kmers, valid
+
+
+def reverse_complement(seq):
+
+    """ Reverse complement of a nucleotide sequence, other characters than nucleotides are kept. """
+
+    return seq.translate(COMPLEMENTS)[::-1]
+
+
+def _set_index(index):
+
+    global _index
+    _index = index
+
+
+def _match_sequences(seqs):
+
+    return _index.match_sequences(seqs)
+
+
+def _set_sequences(seqs):
+
+    global _sequences
+    _sequences = seqs
+
+
+def _verify_pair(task):
+
+    i, j, max_edits = task
+
+    one, two = _sequences[i], _sequences[j]
+    if len(one) > len(two):
+        one, two = two, one
+
+    return edit_distance(one, two, max_edits) <= max_edits
+
+
+def edit_distance(pattern, text, max_edits=None):
+
+    """
+    Minimum edit distance of pattern against any substring of text with the bit-parallel algorithm of Myers (1999),
+    one pass over text with bit-vectors of pattern length. Stops early when the distance can no longer fall to
+    max_edits.
+
+    """
+
+    m = len(pattern)
+
+    if m == 0:
+        return 0
+
+    peq = {}
+    for i, base in enumerate(pattern):
+        peq[base] = peq.get(base, 0) | (1 << i)
+
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+
+    pv = mask
+    mv = 0
+    score = m
+    best = m
+
+    for position, base in enumerate(text):
+        eq = peq.get(base, 0)
+
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+
+        ph = (mv | ~(xh | pv)) & mask
+        mh = pv & xh
+
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+
+        if score < best:
+            best = score
+
+        # Score can decrease by at most one for each remaining base of text:
+        if max_edits is not None and score - (len(text) - position - 1) > max_edits and best > max_edits:
+            break
+
+    return best
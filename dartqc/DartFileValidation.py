@@ -3,6 +3,7 @@ import json
 import csv
 import shutil
 from subprocess import call
+from collections import OrderedDict
 
 import pandas
 import operator
@@ -11,21 +12,28 @@ import re
 import sys
 
 from dartqc.DartModules import RedundancyModule
+from dartqc.DartClustering import SequenceIndex, POOL_CONTEXT
+from dartqc.DartWriter import write_fasta
 from dartqc.DartUtils import stamp
 
 
 class DartFileValidator:
     """
     Class for validating data in the input files before pre-processing but after the file schemas are created
-    (currently cd-hit-2d clusters and validates clone ID's)
+    (currently matches sequences to the official clone ID list in-process or with cd-hit-2d and validates clone ID's)
     """
 
-    def __init__(self, data, attributes, read_counts, ids_file_path):
+    def __init__(self, data, attributes, read_counts, ids_file_path, engine="kmer", threads=1):
         self.data = data
         self.attributes = attributes
         self.read_counts = read_counts
         self.ids_file_path = ids_file_path
 
+        self.engine = engine
+        self.threads = threads
+        self.identity = 0.99
+        self.description_length = 25  # Length of sequence names in cd-hit-2d clusters (-d), including ">"
+
         self.seq_vals = []
         self.seq_renames = {}
 
@@ -39,20 +47,26 @@ class DartFileValidator:
     def do_validations(self):
         os.makedirs(self.tmp_path, exist_ok=True)
 
-        self.create_ids_fasta()
-        self.create_data_fasta()
-        self.cluster()
+        if self.engine == "cdhit":
+            self.create_ids_fasta()
+            self.create_data_fasta()
+            self.cluster()
+
+            clusters = self.parse_clusters()
+        else:
+            clusters = self.match()
 
-        self.validate_sequences()
+        self.validate_sequences(clusters)
         self.write_seq_vals()
         self.rename_sequences()
+        self.rename_data()
 
         shutil.rmtree(self.tmp_path, ignore_errors=True)
 
     def create_data_fasta(self):
         fasta_writer = RedundancyModule(data=self.data, attributes=self.attributes)
 
-        fasta_writer._write_fasta()
+        fasta_writer._write_fasta(fasta_writer._get_sequences())
 
         self.data_fasta_path = os.path.join(self.tmp_path, self.attributes["project"] + "_Seqs.fasta")
 
@@ -61,26 +75,67 @@ class DartFileValidator:
         if ids_file_path is None:
             ids_file_path = self.ids_file_path
 
-        # Read in the official list of clone ID's and convert it into the fasta format
-        fasta_str = ""
+        # Write the fasta file
+        if fasta_file_path is None:
+            fasta_file_path = os.path.abspath(
+                os.path.join(self.tmp_path, self.attributes["project"] + "_ids.fasta"))
+
+        self.id_fasta_path = fasta_file_path
+
+        # Stream the official list of clone ID's into the fasta format
+        with open(ids_file_path, "r") as ids_file:
+            ids_reader = csv.reader(ids_file, delimiter=',')
+            next(ids_reader, None)
+
+            write_fasta(((row[0], row[1]) for row in ids_reader), fasta_file_path)
+
+    def read_ids(self, ids_file_path=None):
+        """ Read the official list of clone ID's and sequences into a dictionary in order of the file """
+
+        if ids_file_path is None:
+            ids_file_path = self.ids_file_path
+
+        ids = OrderedDict()
         with open(ids_file_path, "r") as ids_file:
             ids_reader = csv.reader(ids_file, delimiter=',')
 
             for row in ids_reader:
                 if ids_reader.line_num > 1:
-                    fasta_str = fasta_str + ">" + row[0] + "\n" + row[1][:60] + "\n" + (
-                        row[1][60:] + "\n" if len(row[1]) > 60 else "")
+                    ids[row[0]] = row[1]
 
-        # Write the fasta file
-        if fasta_file_path is None:
-            fasta_file_path = os.path.abspath(
-                os.path.join(self.tmp_path, self.attributes["project"] + "_ids.fasta"))
+        return ids
 
-        self.id_fasta_path = fasta_file_path
+    def match(self):
+        """
+        Match data sequences against an index of the official sequences in-process (exact sequence first, then
+        near matches by shared k-mers verified at identity) across threads, returns clusters in the format of
+        parse_clusters: one cluster for each official sequence with the matched data sequences. Sequence names are
+        truncated to the description length as by cd-hit-2d, so that sequences are classified the same.
+        """
+
+        official = self.read_ids()
+
+        index = SequenceIndex(official, identity=self.identity)
+
+        matches = index.match({snp_id: entry["allele_seq_ref"] for snp_id, entry in self.data.items()},
+                              threads=self.threads)
 
-        with open(fasta_file_path, "w") as fasta_file:
-            fasta_file.write(fasta_str)
-            fasta_file.flush()
+        clusters = OrderedDict((clone_id, [self._split_name(clone_id, self.description_length)])
+                               for clone_id in official.keys())
+
+        for snp_id, clone_id in matches.items():
+            if clone_id is not None:
+                clusters[clone_id].append(self._split_name(snp_id, self.description_length))
+
+        return list(clusters.values())
+
+    @staticmethod
+    def _split_name(name, description_length=25):
+        """ Split sequence name truncated to description length into ID and SNP position as parsed from cd-hit-2d """
+
+        seq_id, _, seq_pos = (">" + name)[:description_length].partition("-")
+
+        return seq_id, seq_pos.lstrip("-")
 
     def cluster(self):
         """ Run CDHIT-EST for sequences, install with sudo apt install cd-hit on Ubuntu """
@@ -107,12 +162,13 @@ class DartFileValidator:
             # -d    SNP ID name length carried from input to output file, min can't be less than 25 otherwise SNP_ID become truncated
             # -M    Allocated memory
             # -T    Threads allocated
-            call([cdhit_path, "-i", self.id_fasta_path, "-i2", self.data_fasta_path, "-o", out_file, "-c", "0.99", "-n",
-                  "10", "-d", "25", "-M", "16000", "-T", "1"], stdout=devnull)
+            call([cdhit_path, "-i", self.id_fasta_path, "-i2", self.data_fasta_path, "-o", out_file, "-c",
+                  str(self.identity), "-n", "10", "-d", str(self.description_length), "-M", "16000", "-T",
+                  str(self.threads)], stdout=devnull)
 
         self.cluster_path = out_file + ".clstr"
 
-    def validate_sequences(self):
+    def parse_clusters(self):
         clusters = []
         with open(self.cluster_path, "r") as clstr_file:
             lines = clstr_file.readlines()
@@ -135,10 +191,16 @@ class DartFileValidator:
             # Add the last cluster in the file (there isn't a following >Cluster line to promt the addition)
             clusters.append(cluster)
 
+        return clusters
+
+    def validate_sequences(self, clusters=None):
+        if clusters is None:
+            clusters = self.parse_clusters()
+
         self.seq_vals = []
+        self.seq_renames = {}
         for index, cluster in enumerate(clusters):
             seq_list = []
-            self.seq_renames = {}
 
             ref_seq = cluster[0]
             ref_seq_str = str(cluster[0][0]) + "--" + str(cluster[0][1])
@@ -211,59 +273,101 @@ class DartFileValidator:
         stamp("Sequence ID filtering info written to ", out_file)
         stamp("Look at this file for more information on any ERRORS and WARNINGS")
 
-    def rename_sequences(self):
-        with open(self.attributes["args"]["raw_scheme"], "r") as infile:
-            config = json.load(infile)
-            counts_allele_col = config["allele_column"] - 1
-            counts_clone_col = config["clone_column"] - 1
-            counts_data_row = config["data_row"] - 1
+    def rename_sequences(self, batch_size=10000):
+        """
+        Rename clone ID's in the call and read count files with the official clone ID's from validation, both files
+        are streamed in parallel processes (if threads > 1) and written in batches of rows
+        """
+
+        renames = self.get_renames()
+
+        files = []
+        for scheme, in_file, suffix in ((self.attributes["args"]["call_scheme"], self.attributes["args"]["call_file"],
+                                         "_data_validated.csv"),
+                                        (self.attributes["args"]["raw_scheme"], self.attributes["args"]["raw_file"],
+                                         "_read_counts_validated.csv")):
+            with open(scheme, "r") as infile:
+                config = json.load(infile)
+
+            out_file = os.path.abspath(os.path.join(self.attributes["out_path"], self.attributes["project"] + suffix))
+
+            files.append((in_file, out_file, config["clone_column"] - 1, config["allele_column"] - 1,
+                          config["data_row"] - 1, renames, batch_size))
+
+        # Parsing CSV holds the GIL, so files are renamed in processes rather than threads:
+        if self.threads > 1:
+            with POOL_CONTEXT.Pool(processes=min(self.threads, len(files))) as pool:
+                return pool.starmap(_rename_file, files)
 
-        with open(self.attributes["args"]["call_scheme"], "r") as infile:
-            config = json.load(infile)
-            call_allele_col = config["allele_column"] - 1
-            call_clone_col = config["clone_column"] - 1
-            call_data_row = config["data_row"] - 1
+        return [_rename_file(*task) for task in files]
 
-        renamed_file_out = os.path.abspath(
-            os.path.join(self.attributes["out_path"], self.attributes["project"] + "_data_validated.csv"))
-        with open(self.attributes["args"]["call_file"], "r") as infile:
-            csv_reader = csv.reader(infile)
+    def get_renames(self):
+        """ Lookup of clone ID's to official clone ID's from the sequence renames of validation """
 
-            with open(renamed_file_out, "w") as val_out_file:
-                csv_writer = csv.writer(val_out_file, delimiter=",", lineterminator='\n')
+        return {self._get_clone_id(seq_id): self._get_clone_id(ref_id) for seq_id, ref_id in self.seq_renames.items()}
 
-                for row in csv_reader:
-                    if csv_reader.line_num > call_data_row:
-                        current_clone_id = row[call_clone_col]
-                        clone_id = current_clone_id if "|" not in current_clone_id else current_clone_id[
-                                                                                        0:current_clone_id.index("|")]
+    @staticmethod
+    def _get_clone_id(seq_id):
 
-                        if clone_id in self.seq_renames:
-                            row[call_clone_col] = row[call_clone_col].replace(clone_id, self.seq_renames[clone_id])
-                            row[call_allele_col] = row[call_allele_col].replace(clone_id, self.seq_renames[clone_id])
+        return seq_id.lstrip(">").partition("|")[0]
 
-                    csv_writer.writerows([row])
+    def rename_data(self):
+        """
+        Rename clone ID's in the data and read counts in memory with the official clone ID's from validation, so that
+        the validated data can be passed on without reading the validated files again
+        """
 
-        renamed_file_out = os.path.abspath(
-            os.path.join(self.attributes["out_path"], self.attributes["project"] + "_read_counts_validated.csv"))
-        with open(self.attributes["args"]["raw_file"], "r") as infile:
-            csv_reader = csv.reader(infile)
+        renames = self.get_renames()
 
-            with open(renamed_file_out, "w") as val_out_file:
-                csv_writer = csv.writer(val_out_file, delimiter=",", lineterminator='\n')
+        if renames:
+            self.data = self._rename_entries(self.data, renames)
 
-                for row in csv_reader:
-                    if csv_reader.line_num > counts_data_row:
-                        current_clone_id = row[counts_clone_col]
-                        clone_id = current_clone_id if "|" not in current_clone_id else current_clone_id[
-                                                                                        0:current_clone_id.index("|")]
+            if self.read_counts is not None:
+                self.read_counts = self._rename_entries(self.read_counts, renames)
 
-                        if clone_id in self.seq_renames:
-                            row[counts_clone_col] = row[counts_clone_col].replace(clone_id, self.seq_renames[clone_id])
-                            row[counts_allele_col] = row[counts_allele_col].replace(clone_id,
-                                                                                    self.seq_renames[clone_id])
+    @staticmethod
+    def _rename_entries(data, renames):
 
-                    csv_writer.writerows([row])
+        renamed = OrderedDict()
+        for allele_id, entry in data.items():
+            official_id = renames.get(entry["clone_id"])
+
+            if official_id is not None:
+                allele_id = allele_id.replace(entry["clone_id"], official_id)
+                entry["allele_id"] = allele_id
+                entry["clone_id"] = official_id
+
+            renamed[allele_id] = entry
+
+        return renamed
 
     def get_data(self):
         return self.data, self.attributes, self.read_counts
+
+
+def _rename_file(in_file, out_file, clone_col, allele_col, data_row, renames, batch_size=10000):
+    """ Stream rows of a DArT file and rename clone ID's of data rows by lookup, writes rows in batches """
+
+    with open(in_file, "r") as infile, open(out_file, "w") as val_out_file:
+        csv_reader = csv.reader(infile)
+        csv_writer = csv.writer(val_out_file, delimiter=",", lineterminator='\n')
+
+        batch = []
+        for row in csv_reader:
+            if csv_reader.line_num > data_row and renames:
+                clone_id = row[clone_col].partition("|")[0]
+                official_id = renames.get(clone_id)
+
+                if official_id is not None:
+                    row[clone_col] = row[clone_col].replace(clone_id, official_id)
+                    row[allele_col] = row[allele_col].replace(clone_id, official_id)
+
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                csv_writer.writerows(batch)
+                batch = []
+
+        csv_writer.writerows(batch)
+
+    return out_file
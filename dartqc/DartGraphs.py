@@ -9,10 +9,87 @@ from matplotlib import colors
 
 import dartqc.SimpleException
 from dartqc.DartModules import SNPModule
+from dartqc.DartMatrix import GenotypeMatrix
 from dartqc.DartUtils import stamp
 
 GRAPH_IMG_TYPE = ".jpg"
 
+# Symbols of the DartQC encoding of calls in the data for the genotype matrix of graph statistics:
+GRAPH_SYMBOLS = {"heterozygous": "0", "homozygous_minor": "1", "homozygous_major": "2", "missing": "-"}
+
+
+class GraphStatistics:
+
+    """
+    Statistics for the plots of DartGraphs as array reductions over the genotype matrix (SNPs x samples), the read
+    count tensor (SNPs x samples x alleles) and arrays of SNP statistics. Bin counts of all plots are computed with
+    numpy.searchsorted, so that plotting functions only draw.
+
+    """
+
+    @staticmethod
+    def histogram(values, edges, right=True):
+
+        """
+        Count values in bins between edges, returns list of len(edges) + 1 counts. Bin i contains values in
+        (edges[i - 1], edges[i]] or with right=False in [edges[i - 1], edges[i]); values above the last edge are
+        counted in the last bin.
+
+        """
+
+        bins = numpy.searchsorted(numpy.asarray(edges, dtype=float), numpy.asarray(values, dtype=float),
+                                  side="left" if right else "right")
+
+        return numpy.bincount(bins, minlength=len(edges) + 1).tolist()
+
+    @staticmethod
+    def get_codes(data):
+
+        """ Encoded genotype matrix (SNPs x samples) of the calls in the data. """
+
+        calls = [entry["calls"] for entry in data.values()]
+        attributes = dict(GRAPH_SYMBOLS, sample_names=list(range(len(calls[0]) if calls else 0)))
+
+        return GenotypeMatrix(data, attributes).codes
+
+    @staticmethod
+    def get_counts(read_data, snps=None):
+
+        """ Read count tensor (SNPs x samples x alleles) of the read count data, SNPs in order of snps if given. """
+
+        if snps is None:
+            snps = list(read_data.keys())
+
+        return numpy.asarray([read_data[snp]["calls"] for snp in snps])
+
+    @staticmethod
+    def call_rates(codes, axis=1):
+
+        """
+        Proportion of homozygous among called genotypes for each SNP (axis 1) or each sample (axis 0), 0 if there are
+        no calls.
+
+        """
+
+        homozygous = ((codes == GenotypeMatrix.homozygous_minor) | (codes == GenotypeMatrix.homozygous_major)).sum(axis)
+        called = (codes != GenotypeMatrix.missing).sum(axis)
+
+        return numpy.where(called == 0, 0, homozygous / numpy.maximum(called, 1))
+
+    @staticmethod
+    def reads_per_snp(counts):
+
+        """ Read counts summed over samples and alleles for each SNP, divided by two. """
+
+        return counts.sum(axis=(1, 2)) / 2.0
+
+    @staticmethod
+    def reads_per_sample(counts):
+
+        """ Read counts summed over SNPs and alleles for each sample, divided by two. """
+
+        return counts.sum(axis=(0, 2)) / 2.0
+
 class DartGraphs:
 
     # Some graphs won't be changed based on filtering (eg. read counts, repAvg & freq Hetz)
@@ -220,26 +297,10 @@ class DartGraphs:
         if not isinstance(read_data, list):
             read_data = [read_data]
 
-        y_data = []
-        all_indiv_read_cnts = []
-
-        for graph_data in read_data:
-            if len(graph_data) == 0:
-                continue
-
-            counts = {k: v["calls"] for (k, v) in graph_data.items()}
+        all_indiv_read_cnts = [GraphStatistics.reads_per_sample(GraphStatistics.get_counts(graph_data))
+                               for graph_data in read_data if len(graph_data) > 0]
 
-            individ_counts = list(zip(*counts.values()))
-            counts_array = numpy.asarray(individ_counts)
-
-            individ_read_counts = (numpy.sum(counts_array, axis=(1, 2)) / 2.0).tolist()
-            all_indiv_read_cnts.append(individ_read_counts)
-
-        biggestCount = 0
-        for individ_read_counts in all_indiv_read_cnts:
-            for count in individ_read_counts:
-                if count > biggestCount:
-                    biggestCount = count
+        biggestCount = max([0] + [float(counts.max()) for counts in all_indiv_read_cnts if len(counts) > 0])
 
         biggestCount = round(biggestCount / 10000.0) * 10000
 
@@ -247,38 +308,9 @@ class DartGraphs:
         x_tick_labels = [("Less than " if idx == 0 else str(round(categories[idx - 1]/1000)) + "k to ") + str(round(num/1000)) + "k" for idx, num in enumerate(categories)]
         x_tick_labels.append("Greater than " + str(round(categories[len(categories) - 1] / 1000)) + "k")
 
-        for individ_read_counts in all_indiv_read_cnts:
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            for count in individ_read_counts:
-                found = False
-                for idx, num in enumerate(categories):
-                    if count < num:
-                        graph_y_data[idx] += 1
-                        found = True
-                        break
-
-                if not found:
-                    graph_y_data[len(graph_y_data) - 1] += 1
-
-
-                # if count <= 1000000:
-                #     graph_y_data[0] += 1
-                # elif count <= 1250000:
-                #     graph_y_data[1] += 1
-                # elif count <= 1500000:
-                #     graph_y_data[2] += 1
-                # elif count <= 1750000:
-                #     graph_y_data[3] += 1
-                # elif count <= 2000000:
-                #     graph_y_data[4] += 1
-                # elif count <= 2250000:
-                #     graph_y_data[5] += 1
-                # elif count <= 2500000:
-                #     graph_y_data[6] += 1
-                # else:
-                #     graph_y_data[7] += 1
-
-            y_data.append(graph_y_data)
+        # Counts below each category, counts above the last category in the last bin
+        y_data = [GraphStatistics.histogram(individ_read_counts, categories, right=False)
+                  for individ_read_counts in all_indiv_read_cnts]
 
         DartGraphs.create_bar_graph(y_data, title, x_tick_labels, x_label, y_label, outfile, color=color, legend=legend)
 
@@ -305,32 +337,11 @@ class DartGraphs:
                 continue
 
             # Find the average reads per SNP
-            counts = {k: v["calls"] for (k, v) in graph_data.items()}
-
-            counts_array = numpy.asarray(list(counts.values()))
-            reads_per_snp = numpy.sum(counts_array, axis=(1, 2)) / 2.0
-            num_samples = numpy.shape(counts_array)[1]
-            avg_reads_per_snp = (reads_per_snp / num_samples).tolist()
+            counts_array = GraphStatistics.get_counts(graph_data)
+            avg_reads_per_snp = GraphStatistics.reads_per_snp(counts_array) / counts_array.shape[1]
 
             # Convert actual values to a count of SNP's in each percentage range
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0]
-            for count in avg_reads_per_snp:
-                if count <= 5:
-                    graph_y_data[0] += 1
-                elif count <= 10:
-                    graph_y_data[1] += 1
-                elif count <= 15:
-                    graph_y_data[2] += 1
-                elif count <= 20:
-                    graph_y_data[3] += 1
-                elif count <= 25:
-                    graph_y_data[4] += 1
-                elif count <= 30:
-                    graph_y_data[5] += 1
-                elif count <= 35:
-                    graph_y_data[6] += 1
-                else:
-                    graph_y_data[7] += 1
+            graph_y_data = GraphStatistics.histogram(avg_reads_per_snp, [5, 10, 15, 20, 25, 30, 35])
 
             y_data.append(graph_y_data)
 
@@ -361,40 +372,10 @@ class DartGraphs:
                 continue
 
             # Find the call rates per SNP
-            calls = [v["calls"] for (k, v) in graph_data.items()]
-            calls_array = numpy.asarray(list(calls))
-
-            # blanks = [(calls == "-").sum() for calls in callsArray]
-            positive_calls = [numpy.asarray([call == "1" or call == "2" for call in call_list]).sum() for call_list in calls_array]
-            tot_calls = [numpy.asarray([call != "-" for call in call_list]).sum() for call_list in calls_array]
-
-            call_rate_per_snp = [0 if tot == 0 else pos / tot for pos, tot in zip(positive_calls, tot_calls)]
+            call_rate_per_snp = GraphStatistics.call_rates(GraphStatistics.get_codes(graph_data), axis=1)
 
             # Convert actual call rates into counts in each percentage range.
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            for count in call_rate_per_snp:
-                if count <= .50:
-                    graph_y_data[0] += 1
-                elif count <= .55:
-                    graph_y_data[1] += 1
-                elif count <= .60:
-                    graph_y_data[2] += 1
-                elif count <= .65:
-                    graph_y_data[3] += 1
-                elif count <= .70:
-                    graph_y_data[4] += 1
-                elif count <= .75:
-                    graph_y_data[5] += 1
-                elif count <= .80:
-                    graph_y_data[6] += 1
-                elif count <= .85:
-                    graph_y_data[7] += 1
-                elif count <= .90:
-                    graph_y_data[8] += 1
-                elif count <= .95:
-                    graph_y_data[9] += 1
-                else:
-                    graph_y_data[10] += 1
+            graph_y_data = GraphStatistics.histogram(call_rate_per_snp, [.50, .55, .60, .65, .70, .75, .80, .85, .90, .95])
 
             y_data.append(graph_y_data)
 
@@ -424,43 +405,10 @@ class DartGraphs:
                 continue
 
             # Find the call rates per individual
-            calls = [v["calls"] for (k, v) in graph_data.items()]
-            individ_calls = list(zip(*calls))
-            calls_array = numpy.asarray(list(individ_calls))
-
-            # blanks = [(calls == "-").sum() for calls in callsArray]
-            # positive_calls = [((calls == "1") | (calls == "2")).sum() for calls in calls_array]
-            # tot_calls = [(calls != "-").sum() for calls in calls_array]
-            positive_calls = [numpy.asarray([call == "1" or call == "2" for call in call_list]).sum() for call_list in calls_array]
-            tot_calls = [numpy.asarray([call != "-" for call in call_list]).sum() for call_list in calls_array]
-
-            call_rate_per_snp = [0 if tot == 0 else pos / tot for pos, tot in zip(positive_calls, tot_calls)]
+            call_rate_per_individ = GraphStatistics.call_rates(GraphStatistics.get_codes(graph_data), axis=0)
 
             # Convert to counts within eac call rate percentage range.
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            for count in call_rate_per_snp:
-                if count <= .50:
-                    graph_y_data[0] += 1
-                elif count <= .55:
-                    graph_y_data[1] += 1
-                elif count <= .60:
-                    graph_y_data[2] += 1
-                elif count <= .65:
-                    graph_y_data[3] += 1
-                elif count <= .70:
-                    graph_y_data[4] += 1
-                elif count <= .75:
-                    graph_y_data[5] += 1
-                elif count <= .80:
-                    graph_y_data[6] += 1
-                elif count <= .85:
-                    graph_y_data[7] += 1
-                elif count <= .90:
-                    graph_y_data[8] += 1
-                elif count <= .95:
-                    graph_y_data[9] += 1
-                else:
-                    graph_y_data[10] += 1
+            graph_y_data = GraphStatistics.histogram(call_rate_per_individ, [.50, .55, .60, .65, .70, .75, .80, .85, .90, .95])
 
             y_data.append(graph_y_data)
 
@@ -492,40 +440,9 @@ class DartGraphs:
                 continue
 
             # Conver the actual MAF data into counts within the graphs ranges
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            for (k, maf) in graph_data.items():
-                if maf <= .01:
-                    graph_y_data[0] += 1
-                elif maf <= .02:
-                    graph_y_data[1] += 1
-                elif maf <= .03:
-                    graph_y_data[2] += 1
-                elif maf <= .04:
-                    graph_y_data[3] += 1
-                elif maf <= .05:
-                    graph_y_data[4] += 1
-                elif maf <= .06:
-                    graph_y_data[5] += 1
-                elif maf <= .07:
-                    graph_y_data[6] += 1
-                elif maf <= .08:
-                    graph_y_data[7] += 1
-                elif maf <= .09:
-                    graph_y_data[8] += 1
-                elif maf <= .1:
-                    graph_y_data[9] += 1
-                elif maf <= .15:
-                    graph_y_data[10] += 1
-                elif maf <= .2:
-                    graph_y_data[11] += 1
-                elif maf <= .3:
-                    graph_y_data[12] += 1
-                elif maf <= .4:
-                    graph_y_data[13] += 1
-                elif maf <= .5:
-                    graph_y_data[14] += 1
-                else:
-                    graph_y_data[15] += 1
+            graph_y_data = GraphStatistics.histogram(list(graph_data.values()),
+                                                     [.01, .02, .03, .04, .05, .06, .07, .08, .09, .1, .15, .2, .3, .4,
+                                                      .5])
 
             y_data.append(graph_y_data)
 
@@ -557,22 +474,7 @@ class DartGraphs:
             rep_avgs = [v["rep_average"] for (k, v) in graph_data.items()]
 
             # Convert to counts within each graph range
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0]
-            for count in rep_avgs:
-                if count <= .9:
-                    graph_y_data[0] += 1
-                elif count <= .92:
-                    graph_y_data[1] += 1
-                elif count <= .94:
-                    graph_y_data[2] += 1
-                elif count <= .96:
-                    graph_y_data[3] += 1
-                elif count <= .98:
-                    graph_y_data[4] += 1
-                elif count <= .99:
-                    graph_y_data[5] += 1
-                else:
-                    graph_y_data[6] += 1
+            graph_y_data = GraphStatistics.histogram(rep_avgs, [.9, .92, .94, .96, .98, .99])
 
             y_data.append(graph_y_data)
 
@@ -605,31 +507,11 @@ class DartGraphs:
             if len(graph_data) == 0:
                 continue
 
-            freq_hetz = [v["freq_heterozygous"] for (k, v) in graph_data.items()]
-
-            # Convert into counts within each graph range
-            graph_y_data = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-            for count in freq_hetz:
-                if float(count) < .10:
-                    graph_y_data[0] += 1
-                elif float(count) <= .20:
-                    graph_y_data[1] += 1
-                elif float(count) <= .30:
-                    graph_y_data[2] += 1
-                elif float(count) <= .40:
-                    graph_y_data[3] += 1
-                elif float(count) <= .50:
-                    graph_y_data[4] += 1
-                elif float(count) <= .60:
-                    graph_y_data[5] += 1
-                elif float(count) <= .70:
-                    graph_y_data[6] += 1
-                elif float(count) <= .80:
-                    graph_y_data[7] += 1
-                elif float(count) <= .90:
-                    graph_y_data[8] += 1
-                else:
-                    graph_y_data[9] += 1
+            freq_hetz = [float(v["freq_heterozygous"]) for (k, v) in graph_data.items()]
+
+            # Convert into counts within each graph range, first range excludes 10%
+            graph_y_data = GraphStatistics.histogram(freq_hetz, [numpy.nextafter(.10, 0), .20, .30, .40, .50, .60, .70,
+                                                                 .80, .90])
 
             y_data.append(graph_y_data)
 
@@ -638,6 +520,40 @@ class DartGraphs:
 
         print(title + ": " + str(round((time.time() - start), 2)) + "s - " + outfile)
 
+    # (Graph 10) Retained samples across sample missingness (mind) thresholds
+    @staticmethod
+    def mind_curve(sweep, outfile, color="teal", legend=None):
+        start = time.time()
+
+        title = "Samples retained across sample missingness (mind) thresholds"
+        y_label = "Number of samples retained"
+        x_label = "Sample missingness threshold (mind)"
+
+        x_data = [entry["value"] for entry in sweep]
+        y_data = [entry["samples"] for entry in sweep]
+
+        DartGraphs.create_scatter_plot(x=[x_data], y=[y_data], title=title, x_tick_labels=None, x_label=x_label,
+                                       y_label=y_label, outfile=outfile, color=color, legend=legend)
+
+        print(title + ": " + str(round((time.time() - start), 2)) + "s - " + outfile)
+
+    # (Graph 11) Mean SNP call rate across sample missingness (mind) thresholds
+    @staticmethod
+    def mind_call_rate_curve(sweep, outfile, color="teal", legend=None):
+        start = time.time()
+
+        title = "Mean SNP call rate across sample missingness (mind) thresholds"
+        y_label = "Mean call rate of SNPs"
+        x_label = "Sample missingness threshold (mind)"
+
+        x_data = [entry["value"] for entry in sweep]
+        y_data = [entry["call_rate_mean"] for entry in sweep]
+
+        DartGraphs.create_scatter_plot(x=[x_data], y=[y_data], title=title, x_tick_labels=None, x_label=x_label,
+                                       y_label=y_label, outfile=outfile, color=color, legend=legend)
+
+        print(title + ": " + str(round((time.time() - start), 2)) + "s - " + outfile)
+
     # (Graph 8) Relationship between MAF and Read Count
     @staticmethod
     def maf_to_read_count(snp_maf, read_data, outfile, color=None, legend=None):
@@ -659,11 +575,9 @@ class DartGraphs:
                 continue
 
             # Get the read count values in the same order as the MAF data
-            counts = [read_data[k]["calls"] for (k, v) in graph_data.items() if k in read_data]
-
-            counts_array = numpy.asarray(counts)
+            snps = [k for k in graph_data.keys() if k in read_data]
 
-            reads_per_snp = (numpy.sum(counts_array, axis=(1, 2)) / 2.0).tolist()
+            reads_per_snp = GraphStatistics.reads_per_snp(GraphStatistics.get_counts(read_data, snps=snps)).tolist()
             x_data.append(reads_per_snp)
 
             # Find MAF for a SNP
@@ -699,16 +613,7 @@ class DartGraphs:
                 continue
 
             # Get the call rate by SNP
-            calls = [v["calls"] for (k, v) in graph_data.items()]
-            calls_array = numpy.asarray(list(calls))
-
-            # blanks = [(calls == "-").sum() for calls in callsArray]
-            # positive_calls = [((calls == "1") | (calls == "2")).sum() for calls in calls_array]
-            # tot_calls = [(calls != "-").sum() for calls in calls_array]
-            positive_calls = [numpy.asarray([call == "1" or call == "2" for call in call_list]).sum() for call_list in calls_array]
-            tot_calls = [numpy.asarray([call != "-" for call in call_list]).sum() for call_list in calls_array]
-
-            call_rate_per_snp = [0 if tot == 0 else pos / tot for pos, tot in zip(positive_calls, tot_calls)]
+            call_rate_per_snp = GraphStatistics.call_rates(GraphStatistics.get_codes(graph_data), axis=1).tolist()
             x_data.append(call_rate_per_snp)
 
             # Find MAF for a SNP
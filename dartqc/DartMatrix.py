@@ -0,0 +1,294 @@
+import numpy
+
+
+class GenotypeMatrix:
+
+    """
+    Encoded genotype matrix (SNPs x samples) of the data dictionary from DartReader for vectorized calculations.
+
+    Calls are stored as small integer codes in the order of the DartQC encoding (0: heterozygous, 1: homozygous minor,
+    2: homozygous major) with missing calls as 3, so that each SNP row can be counted in a single pass.
+
+    """
+
+    heterozygous = 0
+    homozygous_minor = 1
+    homozygous_major = 2
+    missing = 3
+
+    def __init__(self, data, attributes, snps=None, codes=None, block_size=1024):
+
+        self.attributes = attributes
+
+        if snps is None:
+            snps = list(data.keys())
+
+        self.snps = snps  # Row order of SNP IDs
+        self.sample_names = attributes["sample_names"]  # Column order of samples
+
+        self.symbols = [attributes["heterozygous"], attributes["homozygous_minor"], attributes["homozygous_major"],
+                        attributes["missing"]]
+
+        if codes is None:
+            codes = self._encode([data[snp]["calls"] for snp in snps], block_size=block_size)
+
+        self.codes = codes
+
+    def _encode(self, calls, block_size=1024):
+
+        """
+        Encode calls into a preallocated matrix of codes in blocks of SNPs, so that only one block of calls is held as
+        array of strings at a time. Blocks of calls decoded lazily from codes (CallRow) are copied as codes.
+
+        """
+
+        n_samples = len(calls[0]) if calls else len(self.sample_names)
+        codes = numpy.empty((len(calls), n_samples), dtype=numpy.uint8)
+
+        for start in range(0, len(calls), block_size):
+            block = calls[start:start + block_size]
+
+            if any(len(snp_calls) != n_samples for snp_calls in block):
+                raise ValueError("Number of calls is not the same across SNPs.")
+
+            if all(isinstance(snp_calls, CallRow) for snp_calls in block):
+                block_codes = numpy.array([snp_calls.recode(self.symbols) for snp_calls in block], dtype=numpy.uint8)
+                block_codes = block_codes.reshape(len(block), n_samples)
+            else:
+                block = numpy.asarray([list(snp_calls) if isinstance(snp_calls, CallRow) else snp_calls
+                                       for snp_calls in block])
+                block_codes = numpy.full(block.shape, 255, dtype=numpy.uint8)
+                for code, symbol in enumerate(self.symbols):
+                    block_codes[block == symbol] = code
+
+            if (block_codes == 255).any():
+                raise ValueError("Calls must be encoded as one of: " + ", ".join(self.symbols))
+
+            codes[start:start + block_size] = block_codes
+
+        return codes
+
+    def counts(self, groups=None, block_size=1024):
+
+        """
+        Count genotype codes for each SNP in one pass over the matrix, returns an array (SNPs x 4) of counts for
+        heterozygous, homozygous minor, homozygous major and missing calls.
+
+        With groups (integer group index for each sample, -1 for samples without group) the counts are reduced per
+        group in the same pass and returned as array (SNPs x groups x 4).
+
+        """
+
+        if groups is None:
+            counts = numpy.zeros((self.codes.shape[0], 4), dtype=numpy.int64)
+        else:
+            indicator = self._get_indicator(groups)
+            counts = numpy.zeros((self.codes.shape[0], indicator.shape[1], 4), dtype=numpy.int64)
+
+        for start in range(0, self.codes.shape[0], block_size):
+            block = self.codes[start:start + block_size]
+            for code in range(4):
+                if groups is None:
+                    counts[start:start + block_size, code] = (block == code).sum(axis=1)
+                else:
+                    counts[start:start + block_size, :, code] = numpy.dot((block == code).astype(numpy.float32),
+                                                                           indicator)
+
+        return counts
+
+    def _get_indicator(self, groups):
+
+        """ Indicator matrix (samples x groups) for grouped reductions as matrix product. """
+
+        groups = numpy.asarray(groups, dtype=int)
+
+        if len(groups) != self.codes.shape[1]:
+            raise ValueError("Groups must contain one index for each sample.")
+
+        n_groups = int(groups.max()) + 1 if len(groups) > 0 else 0
+
+        indicator = numpy.zeros((len(groups), n_groups), dtype=numpy.float32)
+        grouped = numpy.flatnonzero(groups >= 0)
+        indicator[grouped, groups[grouped]] = 1
+
+        return indicator
+
+    def standardize(self, start=0, stop=None):
+
+        """
+        Minor allele dosages (0, 1, 2) centered and scaled to unit norm for each SNP, returns an array (SNPs x samples)
+        of 32-bit floats. Missing calls are set to the mean dosage of the SNP (0 after centering), so that the product
+        of two rows is the genotype correlation (r) between SNPs. Monomorphic SNPs are set to 0.
+
+        Only the rows from start to stop are standardized, so that large matrices can be standardized in blocks.
+
+        """
+
+        codes = self.codes[start:stop]
+
+        dosages = numpy.array([1, 2, 0, 0], dtype=numpy.float32)[codes]
+        called = codes != self.missing
+
+        n_called = numpy.maximum(called.sum(axis=1), 1)
+        means = (dosages * called).sum(axis=1) / n_called
+
+        standardized = (dosages - means[:, None]) * called
+
+        norms = numpy.sqrt((standardized ** 2).sum(axis=1))
+        norms[norms == 0] = numpy.inf
+
+        return (standardized / norms[:, None]).astype(numpy.float32)
+
+    def select(self, snps=None, samples=None):
+
+        """ Returns a new matrix with a subset of SNP rows and sample columns (boolean masks or index arrays). """
+
+        codes = self.codes
+        snp_ids = self.snps
+        attributes = dict(self.attributes)
+
+        if snps is not None:
+            snps = self._get_index(snps)
+            codes = codes[snps]
+            snp_ids = [self.snps[i] for i in snps]
+
+        if samples is not None:
+            samples = self._get_index(samples)
+            codes = codes[:, samples]
+            attributes["sample_names"] = [self.sample_names[i] for i in samples]
+            attributes["sample_size"] = len(samples)
+
+        return GenotypeMatrix(None, attributes, snps=snp_ids, codes=codes)
+
+    @staticmethod
+    def _get_index(selection):
+
+        selection = numpy.asarray(selection)
+
+        if selection.dtype == bool:
+            return numpy.flatnonzero(selection)
+
+        return selection.astype(int)
+
+    def decode(self):
+
+        """ Decode matrix rows back to lists of calls in the DartQC encoding. """
+
+        return numpy.array(self.symbols)[self.codes].tolist()
+
+    def update_data(self, data):
+
+        """
+        Replace calls of SNPs in the data dictionary with the rows of the matrix, which are decoded lazily (CallRow)
+        and copied as codes when the data is encoded again.
+
+        """
+
+        for i, snp in enumerate(self.snps):
+            data[snp]["calls"] = CallRow(self.codes[i], self.symbols)
+
+        return data
+
+    def pack(self):
+
+        """
+        Pack the genotype codes 2 bits per call into two bit-planes per sample (low and high bit of the code), returns
+        arrays (samples x words) of 64-bit words over SNPs and the number of padding bits in the last word. Padding is
+        packed as missing (both bits set), so that heterozygous calls (00) are not counted in padding.
+
+        """
+
+        n_snps = self.codes.shape[0]
+        n_bytes = ((n_snps + 63) // 64) * 8
+
+        sample_major = self.codes.T
+
+        planes = []
+        for plane in (sample_major & 1, sample_major >> 1):
+            packed = numpy.zeros((sample_major.shape[0], n_bytes), dtype=numpy.uint8)
+            packed[:, :(n_snps + 7) // 8] = numpy.packbits(plane, axis=1)
+            planes.append(packed)
+
+        padding = numpy.ones(n_bytes * 8, dtype=numpy.uint8)
+        padding[:n_snps] = 0
+        padding = numpy.packbits(padding)
+
+        low, high = [(plane | padding).view(numpy.uint64) for plane in planes]
+
+        return low, high, n_bytes * 8 - n_snps
+
+
+class CallRow:
+
+    """
+    Read-only sequence of the calls of a SNP decoded lazily from a row of genotype codes (e.g. a row of the
+    memory-mapped genotype matrix of the project store) with the symbols of the encoding. Calls are only decoded to
+    strings when they are accessed, GenotypeMatrix copies the codes directly.
+
+    """
+
+    def __init__(self, codes, symbols):
+
+        self.codes = codes
+        self.symbols = list(symbols)
+
+    def __len__(self):
+
+        return len(self.codes)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return [self.symbols[code] for code in self.codes[index].tolist()]
+
+        return self.symbols[self.codes[index]]
+
+    def __iter__(self):
+
+        return iter(self.tolist())
+
+    def __eq__(self, other):
+
+        if isinstance(other, (CallRow, list, tuple)):
+            return self.tolist() == list(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+
+        equal = self.__eq__(other)
+
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+
+        return "CallRow(" + repr(self.tolist()) + ")"
+
+    def count(self, call):
+
+        """ Number of calls equal to call, counted on the codes. """
+
+        if call not in self.symbols:
+            return 0
+
+        return int(numpy.count_nonzero(self.codes == self.symbols.index(call)))
+
+    def recode(self, symbols):
+
+        """ Codes of the calls in the order of other symbols, 255 for calls that are not one of the symbols. """
+
+        if symbols == self.symbols:
+            return self.codes
+
+        table = numpy.array([symbols.index(symbol) if symbol in symbols else 255 for symbol in self.symbols],
+                            dtype=numpy.uint8)
+
+        return table[self.codes]
+
+    def tolist(self):
+
+        """ Decoded calls as list of strings. """
+
+        return [self.symbols[code] for code in self.codes.tolist()]
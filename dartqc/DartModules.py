@@ -1,19 +1,23 @@
 import csv
+import json
+import hashlib
 import operator
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import call
 
 import pandas
 import numpy
-from Bio import SeqIO
-from Bio.Alphabet import IUPAC
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
 from scipy import stats
 
 from dartqc.DartUtils import stamp
 from dartqc.DartMessages import DartMessages
+from dartqc.DartMatrix import GenotypeMatrix
+from dartqc.DartClustering import KmerClusterer
+from dartqc.DartWriter import write_fasta
+
+POPCOUNT_TABLE = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
 
 
 class SummaryModule:
@@ -62,7 +66,8 @@ class SummaryModule:
 
         project_param = {"project": self.attributes["project"], "snps": self.attributes["snps"]}
 
-        snp_removed = self._get_snp_sum([removed_red, removed_pop, removed_snp])
+        # Sample results only add SNPs removed by the convergence filter:
+        snp_removed = self._get_snp_sum([removed_red, removed_pop, removed_snp, removed_sam])
         project_removed = {"project": self.attributes["project"], "snps": snp_removed}
 
         row_param = {k: v for d in [project_param, params_ppr, params_sam, params_pop, params_snp, params_red]
@@ -82,7 +87,8 @@ class SummaryModule:
         s = 0
         for d in dicts:
             for k, v in d.items():
-                if k in ("maf", "hwe", "rep_average", "monomorphic", "call_rate", "clusters", "duplicates"):
+                if k in ("maf", "hwe", "rep_average", "monomorphic", "call_rate", "clusters", "duplicates", "ho", "he",
+                         "pic", "fis", "stratified", "converge", "linkage"):
                     if v is not None:
                         s += int(v)
 
@@ -110,11 +116,14 @@ class SummaryModule:
     def _get_sample_results(self):
 
         try:
-            removed = {"mind": self.attributes["individual"]["results"]["mind"]["removed_samples"],
-                       "samples": self.attributes["individual"]["results"]["mind"]["removed_samples"]}
+            results = self.attributes["modules"]["individual"]["results"]
+            states = self.attributes["modules"]["individual"]["states"]
+
+            removed = {"mind": results["mind"]["removed_samples"],
+                       "samples": results["mind"]["removed_samples"]}
 
-            params = {"mind": self.attributes["individual"]["results"]["mind"]["value"],
-                      "samples": len(self.attributes["individual"]["states"]["mind"]["sample_names_original"])}
+            params = {"mind": results["mind"]["value"],
+                      "samples": len(states["mind"]["sample_names_original"])}
 
         except KeyError:
             stamp("Could not detect results for Sample Module, skipping...")
@@ -122,6 +131,14 @@ class SummaryModule:
             params = {"mind": None, "samples": None}
             removed = {"mind": None, "samples": None}
 
+        try:
+            converge = self.attributes["modules"]["individual"]["results"]["converge"]
+            params["converge"] = converge["iterations"]
+            removed["converge"] = converge["removed_snps"]
+        except KeyError:
+            params["converge"] = None
+            removed["converge"] = None
+
         return params, removed
 
     def _get_pop_results(self):
@@ -134,6 +151,13 @@ class SummaryModule:
             params = {"monomorphic": None}
             removed = {"monomorphic": None}
 
+        try:
+            removed["stratified"] = self.attributes["modules"]["population"]["results"]["stratified"]["removed"]
+            params["stratified"] = self.attributes["modules"]["population"]["settings"]["stratified"]["value"]
+        except KeyError:
+            params["stratified"] = None
+            removed["stratified"] = None
+
         return params, removed
 
     def _get_redundancy_results(self):
@@ -141,15 +165,15 @@ class SummaryModule:
         try:
             parameters = self.attributes["modules"]["redundancy"]["settings"]
             params = {"clusters": parameters["clusters"], "duplicates": parameters["duplicates"],
-                      "identity:": parameters["identity"]}
+                      "identity:": parameters["identity"], "linkage": parameters.get("r2")}
             results = self.attributes["modules"]["redundancy"]["results"]
 
             removed = {"clusters": results["clusters"]["removed"], "duplicates": results["duplicates"]["removed"],
-                       "identity": None}
+                       "identity": None, "linkage": results.get("linkage", {}).get("removed")}
         except KeyError:
             stamp("Could not detect results for Redundancy Module, skipping...")
-            params = {"clusters": None, "duplicates": None, "identity": None}
-            removed = {"clusters": None, "duplicates": None, "identity": None}
+            params = {"clusters": None, "duplicates": None, "identity": None, "linkage": None}
+            removed = {"clusters": None, "duplicates": None, "identity": None, "linkage": None}
 
         return params, removed
 
@@ -170,7 +194,27 @@ class SummaryModule:
 
         return params, removed
 
-    def write_matrix(self, combination_matrix, r_matrix=None, file="combination_table.csv", r_file="r_matrix.csv"):
+    def write_fst(self, fst, pops, file="fst_matrix.csv"):
+
+        """ Write pairwise Fst matrix between populations from PopulationModule.calculate_fst """
+
+        out_file = os.path.join(self.out_path, self.attributes["project"] + "_" + file)
+
+        with open(out_file, "w") as fst_file:
+            writer = csv.writer(fst_file)
+            writer.writerow(["population"] + list(pops))
+            writer.writerows([[pop] + row for pop, row in zip(pops, numpy.asarray(fst).tolist())])
+
+        return out_file
+
+    def write_matrix(self, combination_matrix, r_matrix=None, file="combination_table.csv", r_file="r_matrix.csv",
+                     cube=None, parameters=None, values=None, cube_file="combination_cube.npz"):
+
+        """
+        Write combination table and R matrix from CombinationModule, optionally with the retained SNP cube from
+        CombinationModule.get_cube as array file with the parameters and value vectors of its axes.
+
+        """
 
         out_file = os.path.join(self.out_path, file)
 
@@ -184,6 +228,13 @@ class SummaryModule:
                 writer = csv.writer(out_r_file)
                 writer.writerows(r_matrix)
 
+        if cube is not None:
+            axes = {"values_" + str(parameter): numpy.array(parameter_values, dtype=float)
+                    for parameter, parameter_values in zip(parameters, values)}
+
+            numpy.savez(os.path.join(self.out_path, cube_file), retained=cube, parameters=numpy.array(parameters),
+                        **axes)
+
 
 ########################################################################################################################
 
@@ -225,9 +276,18 @@ class PopulationModule(QualityControl):
         self.populations = {}  # Dictionary of populations and list of member indices
         self.monomorphics = {}  # Dictionary of populations and list of mono SNPs for key pop
 
-        self.attributes["modules"][self.name] = {}
+        self.mono_matrix = None  # Boolean array (SNPs x populations), True if SNP is monomorphic in population
+        self.mono_snps = []  # Order of SNPs in monomorphic array
 
-        self._set_log()
+        self.statistics = {}  # Dictionary of parameters and arrays of values (SNPs x populations)
+        self.statistics_snps = []  # Order of SNPs in arrays of population statistics
+
+        self.fst = None  # Pairwise Fst between populations (populations x populations)
+        self.fst_pops = []  # Order of populations in pairwise Fst
+
+        # Keep log of previous population filters, e.g. for differentiation after filtering:
+        if self.name not in self.attributes["modules"]:
+            self._set_log()
 
         self._get_sample_indices()
 
@@ -262,19 +322,23 @@ class PopulationModule(QualityControl):
 
         if mono == "all":
             mono = len(self.populations)
+        else:
+            mono = int(mono)
+
+        mono_count = self.mono_matrix.sum(axis=1)
 
         if comparison == "==":
-            filtered = {snp: data for snp, data in self.data.items() if data["mono"] == mono}
+            filtered = mono_count == mono
         elif comparison == ">=":
-            filtered = {snp: data for snp, data in self.data.items() if data["mono"] >= mono}
+            filtered = mono_count >= mono
         elif comparison == "<=":
-            filtered = {snp: data for snp, data in self.data.items() if data["mono"] <= mono}
+            filtered = mono_count <= mono
         else:
             raise ValueError("Comparison must be one of: <=, >=, ==")
 
-        filtered_data = {snp: data for snp, data in self.data.items() if snp not in filtered}
+        filtered_data = {snp: self.data[snp] for snp, removed in zip(self.mono_snps, filtered.tolist()) if not removed}
 
-        stamp("Filtered", len(filtered), "SNPs.")
+        stamp("Filtered", int(filtered.sum()), "SNPs.")
 
         attributes = self._log_monomorphic(self.attributes, filtered_data, mono)
 
@@ -282,22 +346,195 @@ class PopulationModule(QualityControl):
 
     def _log_monomorphic(self, attributes, filtered_data, mono):
 
-        attributes["modules"][self.name]["settings"] = {
+        attributes["modules"][self.name]["settings"].update({
             "parameter": "mono",
             "value": mono,
+        })
+
+        attributes["modules"][self.name]["results"].update({
+            "before": len(self.data),
+            "after": len(filtered_data),
+            "removed": len(self.data) - len(filtered_data)
+        })
+
+        attributes["modules"][self.name]["states"].update({
+            "monomorphic": self.monomorphics
+        })
+
+        return attributes
+
+    def filter_populations(self, threshold, parameter="hwe", populations=1, comparison="<="):
+
+        """
+        Filter SNPs by a parameter calculated within each population (maf, call_rate, hwe): SNPs are removed if
+        the parameter is <= (or >=) threshold in at least the given number of populations, e.g. SNPs failing HWE
+        at p <= 0.0001 in >= 2 populations. Populations where the parameter is undefined (NaN) do not fail. Filtered
+        data is retained in the module for the monomorphic filter.
+
+        """
+
+        if comparison not in ("<=", ">="):
+            raise ValueError("Comparison must be one of: <=, >=")
+
+        if parameter not in self.statistics:
+            stamp("Calculating SNP parameters in each population")
+            self.calculate_statistics()
+
+        values = self.statistics[parameter]
+
+        # Comparisons with NaN are False, so that undefined values do not fail:
+        with numpy.errstate(invalid="ignore"):
+            if comparison == "<=":
+                failed = (values <= threshold).sum(axis=1)
+            else:
+                failed = (values >= threshold).sum(axis=1)
+
+        removed = set(snp for snp, fails in zip(self.statistics_snps, failed.tolist()) if fails >= populations)
+
+        filtered_data = {snp: data for snp, data in self.data.items() if snp not in removed}
+
+        stamp("Filtered", len(removed), "SNPs with", parameter.upper(), comparison, threshold, "in >=", populations,
+              "populations.")
+
+        self.attributes["modules"][self.name]["settings"]["stratified"] = {
+            "parameter": parameter,
+            "value": threshold,
+            "comparison": comparison,
+            "populations": populations
         }
 
-        attributes["modules"][self.name]["results"] = {
+        self.attributes["modules"][self.name]["results"]["stratified"] = {
             "before": len(self.data),
             "after": len(filtered_data),
             "removed": len(self.data) - len(filtered_data)
         }
 
-        attributes["modules"][self.name]["states"] = {
-            "monomorphic": self.monomorphics
+        self.data = filtered_data
+
+        return self.data, self.attributes
+
+    def calculate_statistics(self):
+
+        """
+        Calculate MAF, call rate and HWE p-value for each SNP within each population with one grouped reduction over
+        the genotype matrix. Decorates the data dictionary with {population: value} for pop_maf, pop_call_rate and
+        pop_hwe.
+
+        HWE is undefined in populations where the SNP is monomorphic or not called, these p-values are NaN (None in
+        the data) and do not count as failing in the stratified filter.
+
+        """
+
+        matrix = GenotypeMatrix(self.data, self.attributes)
+        pops, groups = self._get_groups()
+
+        counts = matrix.counts(groups=groups)
+
+        # Sample size per population is the sum of genotype counts:
+        statistics = SNPModule._calculate_statistics(counts, counts.sum(axis=-1))
+
+        self.statistics = {parameter: statistics[parameter] for parameter in ("maf", "call_rate", "hwe")}
+        self.statistics["hwe"] = numpy.where(statistics["allele_count_major"] * statistics["allele_count_minor"] > 0,
+                                             statistics["hwe"], numpy.nan)
+        self.statistics_snps = matrix.snps
+
+        for parameter, values in self.statistics.items():
+            for snp, pop_values in zip(matrix.snps, values.tolist()):
+                self.data[snp]["pop_" + parameter] = {pop: (None if value != value else value)
+                                                      for pop, value in zip(pops, pop_values)}
+
+    def calculate_fst(self):
+
+        """
+        Weir & Cockerham (1984) Fst for each SNP across all populations and pairwise between populations from
+        per-population allele counts of one grouped reduction over the genotype matrix. Pairwise Fst is the ratio of
+        variance components summed across SNPs. Decorates the data with Fst across populations for each SNP.
+
+        """
+
+        matrix = GenotypeMatrix(self.data, self.attributes)
+        pops, groups = self._get_groups()
+
+        counts = matrix.counts(groups=groups).astype(float)
+
+        n = counts[..., :GenotypeMatrix.missing].sum(axis=-1)  # Called samples (SNPs x populations)
+        het = counts[..., GenotypeMatrix.heterozygous]
+        minor = counts[..., GenotypeMatrix.homozygous_minor]
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            p = numpy.where(n > 0, (2 * minor + het) / (2 * n), 0)  # Allele frequency
+            h = numpy.where(n > 0, het / n, 0)  # Observed heterozygosity
+
+        a, b, c = self._get_variance_components(n, p, h)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            snp_fst = numpy.where((a + b + c) != 0, a / (a + b + c), 0)
+
+        self.fst = numpy.zeros((len(pops), len(pops)))
+        for i in range(len(pops)):
+            for j in range(i + 1, len(pops)):
+                pair = [i, j]
+                a, b, c = self._get_variance_components(n[:, pair], p[:, pair], h[:, pair])
+                total = (a + b + c).sum()
+                self.fst[i, j] = self.fst[j, i] = a.sum() / total if total != 0 else 0
+
+        self.fst_pops = pops
+
+        for snp, value in zip(matrix.snps, snp_fst.tolist()):
+            self.data[snp]["fst"] = value
+
+        self.attributes["modules"][self.name]["states"]["fst"] = {
+            "populations": pops,
+            "pairwise": self.fst.tolist()
         }
 
-        return attributes
+        return self.fst
+
+    @staticmethod
+    def _get_variance_components(n, p, h):
+
+        """
+        Variance components a (between populations), b (between individuals within populations) and c (within
+        individuals) for each SNP from sample sizes, allele frequencies and observed heterozygosities (SNPs x
+        populations). Populations without calls at a SNP are excluded, components are zero for SNPs with less than
+        two populations or an average sample size <= 1.
+
+        """
+
+        r = (n > 0).sum(axis=-1).astype(float)
+        n_total = n.sum(axis=-1)
+
+        valid = (r > 1) & (n_total > r)
+        r = numpy.where(valid, r, 2)
+
+        n_bar = numpy.where(valid, n_total / r, 2)
+        n_c = (r * n_bar - (n ** 2).sum(axis=-1) / (r * n_bar)) / (r - 1)
+
+        p_bar = (n * p).sum(axis=-1) / (r * n_bar)
+        s_square = (n * (p - p_bar[..., None]) ** 2).sum(axis=-1) / ((r - 1) * n_bar)
+        h_bar = (n * h).sum(axis=-1) / (r * n_bar)
+
+        pq = p_bar * (1 - p_bar)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            a = (n_bar / n_c) * (s_square - (1 / (n_bar - 1)) * (pq - ((r - 1) / r) * s_square - h_bar / 4))
+            b = (n_bar / (n_bar - 1)) * (pq - ((r - 1) / r) * s_square - ((2 * n_bar - 1) / (4 * n_bar)) * h_bar)
+            c = h_bar / 2
+
+        valid &= numpy.isfinite(a) & numpy.isfinite(b)
+
+        return numpy.where(valid, a, 0), numpy.where(valid, b, 0), numpy.where(valid, c, 0)
+
+    def _get_groups(self):
+
+        """ Population index for each sample in order of sample names, -1 for samples without population. """
+
+        groups = numpy.full(len(self.sample_names), -1, dtype=int)
+
+        for index, indices in enumerate(self.populations.values()):
+            groups[indices] = index
+
+        return list(self.populations.keys()), groups
 
     def _get_sample_indices(self):
 
@@ -315,37 +552,30 @@ class PopulationModule(QualityControl):
 
     def _calculate_monomorphics(self):
 
-        for pop in self.populations.keys():
-            self.monomorphics[pop] = []
+        """
+        Monomorphic SNPs in each population from one grouped reduction over the genotype matrix: a SNP is
+        monomorphic in a population if exactly one genotype (0, 1 or 2) is observed in the non-missing calls of
+        its members. Decorates the data with the number of populations in which the SNP is monomorphic.
 
-        for snp, data in self.data.items():
-            number = 0
-            for pop, indices in self.populations.items():
+        """
 
-                # For each SNP get the unique set of calls that is not missing and belongs to the population (pop)
-                calls = set([snp_call for i, snp_call in self._iterate_call_indices(data["calls"])
-                             if i in indices and snp_call != self.missing])
+        matrix = GenotypeMatrix(self.data, self.attributes)
+        pops, groups = self._get_groups()
 
-                # If all calls in this set are the same (i.e. 1, 2 or 0) then
-                # declare SNP monomorphic for this population
+        counts = matrix.counts(groups=groups)
 
-                if len(calls) == 1:
-                    self.monomorphics[pop].append(snp)
-                    number += 1
+        # Distinct non-missing genotypes per SNP and population:
+        distinct = (counts[..., :GenotypeMatrix.missing] > 0).sum(axis=-1)
 
-                    # Repeat for each population
+        self.mono_matrix = distinct == 1
+        self.mono_snps = matrix.snps
 
-            # When done, add the total number of population the SNP
-            # is monomorphic to the data for this SNP
+        for i, pop in enumerate(pops):
+            self.monomorphics[pop] = [snp for snp, mono in zip(matrix.snps, self.mono_matrix[:, i].tolist()) if mono]
 
+        for snp, number in zip(matrix.snps, self.mono_matrix.sum(axis=1).tolist()):
             self.data[snp]["mono"] = number
 
-    @staticmethod
-    def _iterate_call_indices(calls):
-
-        for i, snp_call in enumerate(calls):
-            yield i, snp_call
-
 
 class SampleModule(QualityControl):
     def __init__(self, data, attributes):
@@ -354,6 +584,8 @@ class SampleModule(QualityControl):
 
         self.name = "individual"
 
+        self.matrix = None  # Encoded genotype matrix, shared between sweep and filter
+
         self.attributes["modules"][self.name] = {}
 
         self._set_log()
@@ -371,7 +603,8 @@ class SampleModule(QualityControl):
     def filter_data(self, mind=0.2, recalculate=True):
 
         """
-        Re-write with Pandas
+        Remove samples with missing data > mind. Missingness is calculated as a column reduction over the encoded
+        genotype matrix and samples are removed from calls and attributes with a single boolean mask.
         """
 
         if mind is None:
@@ -381,22 +614,22 @@ class SampleModule(QualityControl):
         stamp("Filtering samples with missing data >", mind)
         stamp("Missing data calculated over", len(self.data), "SNPs")
 
-        mind_prop = self._calculate_mind()
+        matrix = self._get_matrix()
 
-        to_remove = mind_prop[mind_prop > mind].index.tolist()
+        mind_prop = self._calculate_mind(matrix)
 
-        filtered_data = {}
-        for snp, data in self.data.items():
-            data["calls"] = [snp_call for i, snp_call in self._iterate_call_indices(data["calls"])
-                             if i not in to_remove]
-            filtered_data[snp] = data
+        keep = mind_prop <= mind
+        removed = int((~keep).sum())
 
-        attributes = self._adjust_attributes(self.attributes, mind, to_remove)
+        filtered_data = matrix.select(samples=keep).update_data(self.data)
+        self.matrix = None
 
-        percent_removed = format((len(to_remove) / attributes["sample_size"]) * 100, ".2f")
+        percent_removed = format((removed / self.sample_size) * 100, ".2f")
 
         stamp("Removed {r} samples out of {t} samples ({p}%)"
-              .format(r=len(to_remove), t=attributes["sample_size"], p=percent_removed))
+              .format(r=removed, t=self.sample_size, p=percent_removed))
+
+        attributes = self._adjust_attributes(self.attributes, mind, keep)
 
         # Recalculating SNP parameters:
 
@@ -407,245 +640,1022 @@ class SampleModule(QualityControl):
 
         return filtered_data, attributes
 
-    @staticmethod
-    def _iterate_call_indices(calls):
+    def sweep_mind(self, minds=None, full=False):
 
-        for i, snp_call in enumerate(calls):
-            yield i, snp_call
+        """
+        Sample missingness across a list of mind thresholds without filtering the data. Missing calls per sample are
+        counted and sorted once, samples removed at each threshold are a prefix of the sorted samples and the mean
+        SNP call rate after removal is computed from the prefix sums of missing calls in removed samples, so that
+        all thresholds together need a single pass over the genotype matrix and memory in the number of samples.
+        With full (or without thresholds), the sweep is also evaluated at every distinct sample missingness.
+
+        Returns a list of dictionaries for each threshold (ascending) with the mind value, the removed samples (a view
+        of the sample names sorted by missingness, so the sets share memory), the number of removed and retained
+        samples and the mean SNP call rate after removal. Only the mean of the SNP call rates is reported: call rates
+        of each SNP at each threshold would need an array of SNPs for every threshold, which for the full curve is
+        the size of the genotype matrix. The module states keep the sorted sample names once and the number of
+        removed samples for each threshold, the removed samples are the first samples in that order.
 
-    def _calculate_mind(self):
+        """
 
-        calls = {snp_id: data["calls"] for snp_id, data in self.data.items()}
-        df = pandas.DataFrame(calls)
-        mind = (df == self.missing).sum(axis=1)
-        mind /= len(self.data)  # Series
+        matrix = self._get_matrix()
+        n_snps = matrix.codes.shape[0]
 
-        return mind
+        sample_missing = self._count_missing(matrix)
+        mind_prop = sample_missing / max(n_snps, 1)
 
-    def _adjust_attributes(self, attributes, mind, to_remove):
+        values = set() if minds is None else set(minds)
+        if full or minds is None:
+            values.update(numpy.unique(mind_prop).tolist())
 
-        attributes["modules"][self.name]["results"]["mind"] = {
-            "value": mind,
-            "removed_samples": len(to_remove)
-        }
+        values = sorted(values)
 
-        attributes["modules"][self.name]["states"]["mind"] = {
-            "sample_names_original": attributes["sample_names"],
-            "sample_size_original": attributes["sample_size"]
+        order = numpy.argsort(-mind_prop, kind="mergesort")  # Samples with most missing data first
+        ranked = numpy.array(self.sample_names, dtype=object)[order]
+
+        # Number of samples with missingness > mind for each threshold:
+        removed_counts = numpy.searchsorted(-mind_prop[order], -numpy.asarray(values, dtype=float), side="left")
+
+        # Missing calls in the first k removed samples:
+        missing_removed = numpy.concatenate([[0], numpy.cumsum(sample_missing[order])])
+        total_missing = missing_removed[-1]
+
+        sweep = []
+        for mind, removed in zip(values, removed_counts.tolist()):
+            retained = self.sample_size - removed
+
+            if retained > 0 and n_snps > 0:
+                call_rate_mean = 1 - (total_missing - missing_removed[removed]) / (retained * n_snps)
+            else:
+                call_rate_mean = 0
+
+            sweep.append({
+                "value": mind,
+                "removed": ranked[:removed],
+                "removed_samples": removed,
+                "samples": retained,
+                "call_rate_mean": float(call_rate_mean)
+            })
+
+        self.attributes["modules"][self.name]["states"]["mind_sweep"] = {
+            "order": ranked.tolist(),
+            "thresholds": [{"value": entry["value"], "removed_samples": entry["removed_samples"],
+                            "call_rate_mean": entry["call_rate_mean"]} for entry in sweep]
         }
 
-        attributes["sample_names"] = [name for i, name in enumerate(self.sample_names)
-                                      if i not in to_remove]
+        return sweep
 
-        attributes["sample_size"] -= len(to_remove)
+    def converge_missingness(self, mind=0.2, call_rate=0.7, max_iterations=100):
 
-        return attributes
+        """
+        Iterative joint filter of sample missingness (remove samples with missing data > mind) and SNP call rate
+        (remove SNPs with call rate <= call_rate) until no further samples or SNPs are removed. Missing counts per
+        sample and per SNP are computed once and updated by subtracting the missing calls of removed SNPs and
+        samples in each iteration. Each iteration is logged in the module states.
 
+        """
 
-########################################################################################################################
+        stamp("Filtering samples with missing data >", mind, "and SNPs with call rate <=", call_rate,
+              "until convergence")
 
+        matrix = self._get_matrix()
+        missing = matrix.codes == GenotypeMatrix.missing
 
-class RedundancyModule(QualityControl):
-    def __init__(self, data, attributes, tmp_remove=True):
+        sample_keep = numpy.ones(missing.shape[1], dtype=bool)
+        snp_keep = numpy.ones(missing.shape[0], dtype=bool)
 
-        QualityControl.__init__(self, data, attributes)
+        sample_missing = missing.sum(axis=0)
+        snp_missing = missing.sum(axis=1)
 
-        self.name = "redundancy"
+        iterations = []
+        for iteration in range(1, max_iterations + 1):
 
-        self.duplicates = {}
-        self.retained_duplicates = []
-        self.removed_duplicates = []
+            # Samples, missingness across retained SNPs:
+            mind_prop = sample_missing / max(int(snp_keep.sum()), 1)
+            removed_samples = numpy.flatnonzero(sample_keep & (mind_prop > mind))
 
-        self.clusters = {}
-        self.retained_sequences = []
-        self.removed_sequences = []
+            if len(removed_samples) > 0:
+                sample_keep[removed_samples] = False
+                snp_missing -= missing[:, removed_samples].sum(axis=1)
 
-        self.identity = 0.95  # Identity used in Cluster Removal
+            # SNPs, call rate across retained samples:
+            snp_call_rate = 1 - (snp_missing / max(int(sample_keep.sum()), 1))
+            removed_snps = numpy.flatnonzero(snp_keep & (snp_call_rate <= call_rate))
 
-        self.attributes["modules"][self.name] = {}
+            if len(removed_snps) > 0:
+                snp_keep[removed_snps] = False
+                sample_missing -= missing[removed_snps].sum(axis=0)
 
-        self._set_log()
+            iterations.append({
+                "iteration": iteration,
+                "removed_samples": len(removed_samples),
+                "removed_snps": len(removed_snps),
+                "samples": int(sample_keep.sum()),
+                "snps": int(snp_keep.sum())
+            })
 
-        self.tmp_path = os.path.join(self.out_path, "tmp")
-        self.tmp_remove = tmp_remove
+            stamp("Iteration", iteration, "removed", len(removed_samples), "samples and", len(removed_snps), "SNPs")
 
-    def _set_log(self):
+            if len(removed_samples) == 0 and len(removed_snps) == 0:
+                break
 
-        self.attributes["modules"][self.name] = {
-            "results": {"clusters": {
-                "before": None,
-                "after": None,
-                "removed": None
-            }, "duplicates": {
-                "before": None,
-                "after": None,
-                "removed": None
-            }},
-            "settings": {},
-            "states": {}  # States are other parameters of interest not necessary results or settings.
-        }
+        filtered = matrix.select(snps=snp_keep, samples=sample_keep)
+        filtered_data = filtered.update_data({snp: self.data[snp] for snp in filtered.snps})
 
-    def get_data(self, duplicates=True, clusters=True, redundant=False):
+        self.matrix = None
 
-        # Redundant gets retained duplicates and identity clusters
-        # else get removed duplicates and clusters
+        removed_samples = int((~sample_keep).sum())
+        removed_snps = int((~snp_keep).sum())
 
-        data = self.data
+        stamp("Converged after", len(iterations), "iterations, removed", removed_samples, "samples and", removed_snps,
+              "SNPs")
 
-        self.attributes["modules"][self.name]["settings"] = {
-            "duplicates": duplicates,
-            "clusters": clusters,
-            "redundant": redundant,
-            "identity": self.identity
+        self.attributes["modules"][self.name]["settings"]["converge"] = {
+            "mind": mind,
+            "call_rate": call_rate,
+            "max_iterations": max_iterations
         }
 
-        if redundant:
-            duplicate_list = self.retained_duplicates
-            cluster_list = self.retained_sequences
-        else:
-            duplicate_list = self.removed_duplicates
-            cluster_list = self.removed_sequences
+        self.attributes["modules"][self.name]["results"]["converge"] = {
+            "iterations": len(iterations),
+            "removed_samples": removed_samples,
+            "removed_snps": removed_snps
+        }
 
-        # Check if logic is correct:
+        self.attributes["modules"][self.name]["states"]["converge"] = iterations
 
-        if duplicates and clusters:
-            filters = [("duplicates", duplicate_list), ("clusters", cluster_list)]
-        elif clusters and not duplicates:
-            filters = [("clusters", cluster_list)]
-        elif duplicates and not clusters:
-            filters = [("duplicates", duplicate_list)]
-        else:
-            filters = list()
+        attributes = self._adjust_attributes(self.attributes, mind, sample_keep)
 
-        if filters:
-            for mode, filter_list in filters:
-                before = len(data)
-                data = {k: v for (k, v) in data.items() if k not in filter_list}
-                after = len(data)
+        return filtered_data, attributes
 
-                self._log_filters(mode=mode, before=before, after=after)
+    def _get_matrix(self):
 
-                self.messages.get_redundancy_message(mode, before, before - after, after)
+        if self.matrix is None:
+            self.matrix = GenotypeMatrix(self.data, self.attributes)
 
-        self.attributes["modules"][self.name]["states"] = {
-            "duplicates_removed": len(self.removed_duplicates),
-            "sequences_removed": len(self.removed_sequences),
-            "duplicates_retained": len(self.retained_duplicates),
-            "sequences_retained": len(self.retained_sequences),
-        }
+        return self.matrix
 
-        return data, self.attributes
+    @staticmethod
+    def _calculate_mind(matrix):
 
-    def _log_filters(self, mode, before, after):
+        """ Proportion of missing calls for each sample across SNPs in the genotype matrix. """
 
-        self.attributes["modules"][self.name]["results"][mode] = {
-            "before": before,
-            "after": after,
-            "removed": before - after
-        }
+        return SampleModule._count_missing(matrix) / max(matrix.codes.shape[0], 1)
 
-    def remove_duplicates(self, selector="maf", target="clone_id", selector_list=None):
+    @staticmethod
+    def _count_missing(matrix, block_size=1024):
 
-        """Search for duplicate clone IDs in SNPs and remove from data. Wrapper. """
+        """ Number of missing calls for each sample, counted in blocks of SNPs. """
 
-        self._find_duplicates(target=target)
-        self._select_duplicates(selector=selector, selector_list=selector_list)
+        missing = numpy.zeros(matrix.codes.shape[1], dtype=numpy.int64)
 
-    def remove_clusters(self, identity=0.95, target="allele_seq_ref", selector="maf",
-                        selector_list=None, cdhit_path=None):
+        for start in range(0, matrix.codes.shape[0], block_size):
+            missing += (matrix.codes[start:start + block_size] == GenotypeMatrix.missing).sum(axis=0)
 
-        """ Search for sequence identity clusters and remove them from data. Wrapper. """
+        return missing
 
-        self.identity = identity
+    def _adjust_attributes(self, attributes, mind, keep):
 
-        self._find_clusters(target=target, identity=identity, cdhit_path=cdhit_path)
-        self._select_clusters(selector=selector, selector_list=selector_list)
+        attributes["modules"][self.name]["results"]["mind"] = {
+            "value": mind,
+            "removed_samples": int((~keep).sum())
+        }
 
-    # Private functions for Redundancy Module #
+        attributes["modules"][self.name]["states"]["mind"] = {
+            "sample_names_original": attributes["sample_names"],
+            "sample_size_original": attributes["sample_size"]
+        }
 
-    def _find_clusters(self, target="allele_seq_ref", identity=0.95, word_size=10, description_length=0,
-                       cdhit_path=None):
+        attributes["sample_names"] = [name for name, retained in zip(self.sample_names, keep.tolist()) if retained]
 
-        """
-        Clusters the reference allele sequences with CDHIT-EST and parses the clusters for selecting and
-        retaining best sequences.
+        attributes["sample_size"] = len(attributes["sample_names"])
 
-        CD-HIT returns slightly different cluster configurations for each run due to greedy incremental algorithm,
-        but little variation observed between runs in the data for P. monodon. Know thyself!
+        retained = set(attributes["sample_names"])
+        attributes["pops"] = {name: pop for name, pop in attributes["pops"].items() if name in retained}
 
-        """
+        return attributes
 
-        os.makedirs(self.tmp_path, exist_ok=True)
 
-        fasta_path = self._write_fasta(target)
+class IBSModule(QualityControl):
+    def __init__(self, data, attributes, threads=1, block_size=32):
 
-        cluster_path = self._run_cdhit(fasta_path=fasta_path, identity=identity, word_size=word_size,
-                                       description_length=description_length, cdhit_path=cdhit_path)
+        """
+        Identity-by-state across all pairs of samples for detection of duplicated or mislabelled samples. Genotypes
+        are packed 2 bits per call and pairs in the upper triangle are compared in blocks of samples with popcount
+        kernels over 64-bit words, blocks are distributed across threads. Only pairs above the concordance threshold
+        are kept from each block.
 
-        self.clusters = self._parse_cdhit(cluster_path)
+        """
 
-        if self.tmp_remove:
-            shutil.rmtree(self.tmp_path, ignore_errors=True)
+        QualityControl.__init__(self, data, attributes)
 
-    def _select_clusters(self, selector="maf", selector_list=None):
+        self.name = "ibs"
 
-        """ Select best markers from clusters by selector. """
+        self.threads = threads
+        self.block_size = block_size
 
-        for cluster, cluster_members in self.clusters.items():
-            best_sequence = self._compare_entries(cluster_members, selector=selector, selector_list=selector_list)
-            self.retained_sequences.append(best_sequence)
-            self.removed_sequences += [member for member in cluster_members if member != best_sequence]
+        self.sample_missing = None  # Number of missing calls for each sample
 
-    def _write_fasta(self, target="allele_seq_ref"):
+        self.pairs = []  # Sample pairs above concordance threshold
+        self.pairs_file = None  # CSV of sample pairs from write_pairs
 
-        """ Write fasta file of sequences with SNP IDs for CD-HIT. """
+        self.attributes["modules"][self.name] = {}
 
-        file_name = os.path.join(self.tmp_path, self.project + "_Seqs")
+        self._set_log()
 
-        seqs = [SeqRecord(Seq(data[target], IUPAC.unambiguous_dna), id=snp_id, name="", description="")
-                for snp_id, data in self.data.items()]
+    def _set_log(self):
 
-        file_name += ".fasta"
+        self.attributes["modules"][self.name] = {
+            "results": {},
+            "settings": {},
+            "states": {}  # States are other parameters of interest not necessary results or settings.
+        }
 
-        with open(file_name, "w") as fasta_file:
-            SeqIO.write(seqs, fasta_file, "fasta")
+    def calculate_ibs(self, concordance=0.95, min_called=0):
 
-        return file_name
+        """
+        Calculate pairwise IBS counts for all sample pairs and keep pairs with concordance >= threshold and at least
+        min_called SNPs called in both samples. Returns arrays over the flagged pairs of sample indices (rows < columns),
+        SNPs called in both samples, opposite homozygous calls (IBS0), identical calls (IBS2) and shared missing calls.
 
-    def _run_cdhit(self, fasta_path, identity=0.95, word_size=5, description_length=0, cdhit_path=None):
+        """
 
-        """ Run CDHIT-EST for sequences, install with sudo apt install cd-hit on Ubuntu """
+        matrix = GenotypeMatrix(self.data, self.attributes)
 
-        self.messages.get_cdhit_message(identity)
+        low, high, padding = matrix.pack()
+        missing = low & high
 
-        if cdhit_path is None:
-            cdhit_path = "cd-hit-est"
+        n_samples = low.shape[0]
 
-        file_name = self.project + "_IdentityClusters_" + str(identity)
+        self.sample_missing = self._popcount(missing) - padding
 
-        out_file = os.path.join(self.tmp_path, file_name)
-        cluster_path = os.path.join(self.tmp_path, file_name + '.clstr')
+        blocks = [(start, min(start + self.block_size, n_samples))
+                  for start in range(0, n_samples, self.block_size)]
+        block_pairs = [(i, j) for a, i in enumerate(blocks) for j in blocks[a:]]
 
-        stamp("Calling cd-hit-est: " + cdhit_path + " -i " + fasta_path + " -o " + out_file + " -c " + str(identity) +
-              " -n " + str(word_size) + " -d " + str(description_length))
+        stamp("Comparing", n_samples * (n_samples - 1) // 2, "sample pairs across", matrix.codes.shape[0], "SNPs in",
+              len(block_pairs), "blocks with", self.threads, "threads")
 
-        with open(os.devnull, "w") as devnull:
-            call([cdhit_path, "-i", fasta_path, "-o", out_file, "-c", str(identity), "-n", str(word_size),
-                  "-d", str(description_length)], stdout=devnull)
+        def compare(block_pair):
+            (i0, i1), (j0, j1) = block_pair
+            return self._compare_block(low, high, missing, padding, i0, i1, j0, j1, concordance, min_called)
 
-        return cluster_path
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            flagged = list(executor.map(compare, block_pairs))
 
-    def _parse_cdhit(self, file):
+        if not flagged:
+            return [numpy.zeros(0, dtype=numpy.int64) for _ in range(6)]
+
+        return [numpy.concatenate(values) for values in zip(*flagged)]
+
+    def _compare_block(self, low, high, missing, padding, i0, i1, j0, j1, concordance=0.95, min_called=0):
 
         """
-        Parses the CDHIT cluster output and retains only cluster with more than one sequence for selection and
-        removal from total SNPs in dictionary: {cluster_id: snp_ids}
+        Popcount kernel for a block of sample pairs: opposite homozygous calls differ in both bits (01 / 10),
+        identical calls differ in neither, both restricted to SNPs called in both samples. Returns the counts of
+        pairs in the upper triangle with concordance >= threshold, shared missing calls only for these pairs.
 
         """
 
-        identity_clusters = {}
+        both_called = ~(missing[i0:i1, None, :] | missing[None, j0:j1, :])
 
-        with open(file, "r") as clstr_file:
+        diff_low = low[i0:i1, None, :] ^ low[None, j0:j1, :]
+        diff_high = high[i0:i1, None, :] ^ high[None, j0:j1, :]
+
+        called = self._popcount(both_called)
+        ibs0 = self._popcount(diff_low & diff_high & both_called)
+        ibs2 = self._popcount(~(diff_low | diff_high) & both_called)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            pair_concordance = numpy.where(called > 0, ibs2 / called, 0)
+
+        upper = numpy.arange(i0, i1)[:, None] < numpy.arange(j0, j1)[None, :]
+        flagged = upper & (pair_concordance >= concordance) & (called >= min_called) & (called > 0)
+
+        rows, columns = numpy.nonzero(flagged)
+
+        shared_missing = self._popcount(missing[i0 + rows] & missing[j0 + columns]) - padding
+
+        return rows + i0, columns + j0, called[rows, columns], ibs0[rows, columns], ibs2[rows, columns], \
+            shared_missing
+
+    @staticmethod
+    def _popcount(words):
+
+        """ Number of set bits across the last axis of an array of 64-bit words. """
+
+        if hasattr(numpy, "bitwise_count"):
+            return numpy.bitwise_count(words).sum(axis=-1, dtype=numpy.int64)
+
+        return POPCOUNT_TABLE[words.view(numpy.uint8)].sum(axis=-1, dtype=numpy.int64)
+
+    def get_pairs(self, concordance=0.95, min_called=0):
+
+        """
+        Sample pairs with concordance (proportion of identical calls across SNPs called in both samples) >= threshold.
+        Returns list of pairs with sample names, concordance, IBS similarity, SNPs called in both and shared missing.
+
+        """
+
+        rows, columns, called, ibs0, ibs2, shared_missing = self.calculate_ibs(concordance=concordance,
+                                                                               min_called=min_called)
+
+        # Flagged pairs have SNPs called in both samples:
+        pair_concordance = ibs2 / called
+        similarity = (ibs2 + (called - ibs0 - ibs2) / 2) / called
+
+        order = numpy.lexsort((columns, rows, -pair_concordance))
+
+        self.pairs = [{"sample_one": self.sample_names[rows[k]],
+                       "sample_two": self.sample_names[columns[k]],
+                       "concordance": float(pair_concordance[k]),
+                       "ibs": float(similarity[k]),
+                       "called": int(called[k]),
+                       "shared_missing": int(shared_missing[k])}
+                      for k in order.tolist()]
+
+        return self.pairs
+
+    def get_data(self, concordance=0.95, min_called=0, remove=True):
+
+        """
+        Flag sample pairs with concordance >= threshold and remove one sample of each pair: pairs are processed by
+        descending concordance and the sample with more missing calls is removed unless one of the pair was already
+        removed.
+
+        """
+
+        pairs = self.get_pairs(concordance=concordance, min_called=min_called)
+
+        stamp("Detected", len(pairs), "sample pairs with concordance >=", concordance)
+
+        missing = dict(zip(self.sample_names, self.sample_missing.tolist()))
+
+        to_remove = set()
+        for pair in pairs:
+            if pair["sample_one"] in to_remove or pair["sample_two"] in to_remove:
+                continue
+            if missing[pair["sample_two"]] >= missing[pair["sample_one"]]:
+                to_remove.add(pair["sample_two"])
+            else:
+                to_remove.add(pair["sample_one"])
+
+        self.attributes["modules"][self.name]["settings"] = {
+            "concordance": concordance,
+            "min_called": min_called
+        }
+
+        self.attributes["modules"][self.name]["results"] = {
+            "pairs": len(pairs),
+            "removed_samples": len(to_remove) if remove else 0
+        }
+
+        # Pairs are written to CSV with write_pairs instead of the attributes:
+        self.attributes["modules"][self.name]["states"] = {
+            "pairs": len(pairs),
+            "pairs_file": self.pairs_file
+        }
+
+        if not remove or not to_remove:
+            return self.data, self.attributes
+
+        keep = numpy.array([name not in to_remove for name in self.sample_names], dtype=bool)
+
+        matrix = GenotypeMatrix(self.data, self.attributes)
+        filtered_data = matrix.select(samples=keep).update_data(self.data)
+
+        stamp("Removed", len(to_remove), "samples out of", self.sample_size, "samples")
+
+        self.attributes["sample_names"] = [name for name in self.sample_names if name not in to_remove]
+        self.attributes["sample_size"] = len(self.attributes["sample_names"])
+
+        self.attributes["pops"] = {name: pop for name, pop in self.attributes["pops"].items() if name not in to_remove}
+
+        return filtered_data, self.attributes
+
+    def write_pairs(self, file="sample_pairs.csv"):
+
+        """ Write flagged sample pairs to CSV in output path. """
+
+        out_file = os.path.join(self.out_path, self.project + "_" + file)
+
+        columns = ["sample_one", "sample_two", "concordance", "ibs", "called", "shared_missing"]
+
+        with open(out_file, "w") as pair_file:
+            writer = csv.writer(pair_file)
+            writer.writerow(columns)
+            writer.writerows([[pair[column] for column in columns] for pair in self.pairs])
+
+        self.pairs_file = out_file
+        self.attributes["modules"][self.name]["states"]["pairs_file"] = out_file
+
+        return out_file
+
+
+########################################################################################################################
+
+
+class RedundancyModule(QualityControl):
+    def __init__(self, data, attributes, tmp_remove=True, cache=True):
+
+        QualityControl.__init__(self, data, attributes)
+
+        self.name = "redundancy"
+
+        self.duplicates = {}
+        self.retained_duplicates = []
+        self.removed_duplicates = []
+
+        self.clusters = {}
+        self.retained_sequences = []
+        self.removed_sequences = []
+
+        self.identity = 0.95  # Identity used in Cluster Removal
+        self.engine = "cdhit"  # Clustering engine used in Cluster Removal
+
+        self.linked = (numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int))  # Pairs of SNP indices in LD
+        self.retained_linked = []
+        self.removed_linked = []
+
+        self.r2 = None  # Threshold and window used in LD Pruning
+        self.window = None
+
+        self.attributes["modules"][self.name] = {}
+
+        self._set_log()
+
+        self.tmp_path = os.path.join(self.out_path, "tmp")
+        self.tmp_remove = tmp_remove
+
+        # Cluster assignments are cached across runs in the output path, keyed by sequences and parameters:
+        self.cache_path = os.path.join(self.out_path, "cache") if cache else None
+
+    def _set_log(self):
+
+        self.attributes["modules"][self.name] = {
+            "results": {"clusters": {
+                "before": None,
+                "after": None,
+                "removed": None
+            }, "duplicates": {
+                "before": None,
+                "after": None,
+                "removed": None
+            }, "linkage": {
+                "before": None,
+                "after": None,
+                "removed": None
+            }},
+            "settings": {},
+            "states": {}  # States are other parameters of interest not necessary results or settings.
+        }
+
+    def get_data(self, duplicates=True, clusters=True, redundant=False, linkage=False):
+
+        # Redundant gets retained duplicates and identity clusters
+        # else get removed duplicates and clusters
+
+        data = self.data
+
+        self.attributes["modules"][self.name]["settings"] = {
+            "duplicates": duplicates,
+            "clusters": clusters,
+            "redundant": redundant,
+            "identity": self.identity,
+            "engine": self.engine,
+            "linkage": linkage,
+            "r2": self.r2,
+            "window": self.window
+        }
+
+        if redundant:
+            duplicate_list = self.retained_duplicates
+            cluster_list = self.retained_sequences
+            linkage_list = self.retained_linked
+        else:
+            duplicate_list = self.removed_duplicates
+            cluster_list = self.removed_sequences
+            linkage_list = self.removed_linked
+
+        # Check if logic is correct:
+
+        if duplicates and clusters:
+            filters = [("duplicates", duplicate_list), ("clusters", cluster_list)]
+        elif clusters and not duplicates:
+            filters = [("clusters", cluster_list)]
+        elif duplicates and not clusters:
+            filters = [("duplicates", duplicate_list)]
+        else:
+            filters = list()
+
+        if linkage:
+            filters.append(("linkage", linkage_list))
+
+        if filters:
+            for mode, filter_list in filters:
+                filter_list = set(filter_list)
+                before = len(data)
+                data = {k: v for (k, v) in data.items() if k not in filter_list}
+                after = len(data)
+
+                self._log_filters(mode=mode, before=before, after=after)
+
+                self.messages.get_redundancy_message(mode, before, before - after, after)
+
+        self.attributes["modules"][self.name]["states"] = {
+            "duplicates_removed": len(self.removed_duplicates),
+            "sequences_removed": len(self.removed_sequences),
+            "duplicates_retained": len(self.retained_duplicates),
+            "sequences_retained": len(self.retained_sequences),
+            "linked_removed": len(self.removed_linked),
+            "linked_retained": len(self.retained_linked),
+            "linked_pairs": len(self.linked[0])
+        }
+
+        return data, self.attributes
+
+    def _log_filters(self, mode, before, after):
+
+        self.attributes["modules"][self.name]["results"][mode] = {
+            "before": before,
+            "after": after,
+            "removed": before - after
+        }
+
+    def remove_duplicates(self, selector="maf", target="clone_id", selector_list=None):
+
+        """Search for duplicate clone IDs in SNPs and remove from data. Wrapper. """
+
+        self._find_duplicates(target=target)
+        self._select_duplicates(selector=selector, selector_list=selector_list)
+
+    def remove_linkage(self, r2=0.8, window=None, selector="maf", selector_list=None, threads=1, memory=1024):
+
+        """
+        Search for pairs of SNPs with genotype correlation r2 >= threshold and prune SNPs in linkage disequilibrium
+        from data. Wrapper.
+
+        Each SNP is compared with the next <window> SNPs in order of data, or with all SNPs if window is None (whole
+        genome, e.g. without genetic map). Correlations are calculated for blocks of SNPs as matrix product of
+        standardized genotypes across threads, the size of blocks is limited by memory (MB) across threads.
+
+        SNPs removed as duplicates or clusters before are not tested for LD.
+
+        """
+
+        self.r2 = r2
+        self.window = window
+
+        redundant = set(self.removed_duplicates) | set(self.removed_sequences)
+
+        matrix = GenotypeMatrix(self.data, self.attributes, snps=[snp for snp in self.data if snp not in redundant])
+
+        self.linked = self._find_linkage(matrix, r2=r2, window=window, threads=threads, memory=memory)
+
+        self._select_linkage(matrix.snps, selector=selector, selector_list=selector_list)
+
+    def remove_clusters(self, identity=0.95, target="allele_seq_ref", selector="maf", selector_list=None,
+                        cdhit_path=None, engine="cdhit", threads=1, memory=800, word_size=10, clusters=None):
+
+        """
+        Search for sequence identity clusters and remove them from data. Wrapper.
+
+        Clusters of a superset of sequences (dictionary or future from start_clusters) are restricted to the SNPs in
+        data instead of clustering the sequences again.
+
+        """
+
+        self.identity = identity
+        self.engine = engine
+
+        sequences = self._get_sequences(target)
+
+        if clusters is None:
+            clusters = self.cluster_sequences(sequences, identity=identity, word_size=word_size, engine=engine,
+                                              threads=threads, memory=memory, cdhit_path=cdhit_path)
+        else:
+            if hasattr(clusters, "result"):
+                stamp("Waiting for sequence clusters from background...")
+                clusters = clusters.result()
+
+            stamp("Restricting sequence clusters to", len(sequences), "SNPs")
+            clusters = self._restrict_clusters(clusters, sequences)
+
+        self.clusters = clusters
+
+        self._select_clusters(selector=selector, selector_list=selector_list)
+
+    def start_clusters(self, identity=0.95, target="allele_seq_ref", cdhit_path=None, engine="cdhit", threads=1,
+                       memory=800, word_size=10):
+
+        """
+        Start clustering the sequences of all SNPs in data in a background thread, returns a future of the clusters
+        to pass to remove_clusters after filtering. Sequences are copied before starting, so that data can be filtered
+        while sequences are clustered.
+
+        """
+
+        sequences = self._get_sequences(target)
+
+        stamp("Starting to cluster", len(sequences), "sequences in background")
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.cluster_sequences, sequences, identity, word_size, engine, threads, memory,
+                                 cdhit_path)
+        executor.shutdown(wait=False)
+
+        return future
+
+    def cluster_sequences(self, sequences, identity=0.95, word_size=10, engine="cdhit", threads=1, memory=800,
+                          cdhit_path=None):
+
+        """ Cluster sequences (dictionary of ID: sequence) with the engine or read clusters from cache. """
+
+        if engine not in ("cdhit", "kmer"):
+            raise ValueError("Clustering engine must be one of: cdhit, kmer")
+
+        clusters = None
+        if self.cache_path is not None:
+            clusters = self._read_cluster_cache(sequences, identity=identity, word_size=word_size, engine=engine)
+
+        if clusters is None:
+            unique_sequences, multiplicity = self._collapse_sequences(sequences)
+
+            stamp("Clustering", len(unique_sequences), "unique sequences of", len(sequences), "SNPs")
+
+            if engine == "kmer":
+                clusters = self._find_kmer_clusters(unique_sequences, identity=identity, threads=threads)
+            else:
+                clusters = self._find_clusters(unique_sequences, identity=identity, word_size=word_size,
+                                               cdhit_path=cdhit_path, threads=threads, memory=memory)
+
+            clusters = self._expand_clusters(clusters, multiplicity)
+
+            if self.cache_path is not None:
+                self._write_cluster_cache(sequences, clusters, identity=identity, word_size=word_size, engine=engine)
+
+        return clusters
+
+    # Private functions for Redundancy Module #
+
+    def _find_linkage(self, matrix, r2=0.8, window=None, threads=1, memory=1024):
+
+        """
+        Pairs of SNP indices (rows, columns) with r2 >= threshold from blocks of standardized genotypes, which are
+        standardized for each block from the genotype matrix.
+
+        """
+
+        n_snps, n_samples = matrix.codes.shape
+
+        # Each thread holds correlations of a pair of blocks (and their squares) and the standardized genotypes of
+        # both blocks with temporaries, about 2 * block_size ** 2 + 6 * block_size * samples 32-bit floats:
+        budget = memory * 2 ** 20 / (4 * threads)
+        block_size = int((numpy.sqrt(36 * n_samples ** 2 + 8 * budget) - 6 * n_samples) / 4)
+        block_size = max(1, min(n_snps, block_size))
+
+        if window is not None:
+            block_size = min(block_size, max(window, 1))
+
+        stamp("Calculating LD between", n_snps, "SNPs in blocks of", block_size, "SNPs on", threads, "threads")
+
+        starts = list(range(0, n_snps, block_size))
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            blocks = list(executor.map(lambda start: self._compare_linkage(matrix, start, start + block_size,
+                                                                            r2=r2, window=window), starts))
+
+        rows = numpy.concatenate([block[0] for block in blocks] + [numpy.zeros(0, dtype=int)])
+        cols = numpy.concatenate([block[1] for block in blocks] + [numpy.zeros(0, dtype=int)])
+
+        return rows, cols
+
+    @staticmethod
+    def _compare_linkage(matrix, start, end, r2=0.8, window=None):
+
+        """
+        Compare block of SNPs with all following SNPs within window in blocks of the same size, returns pairs with
+        r2 >= threshold.
+
+        """
+
+        n_snps = matrix.codes.shape[0]
+        end = min(end, n_snps)
+        stop = n_snps if window is None else min(n_snps, end + window)
+
+        standardized = matrix.standardize(start, end)
+
+        pairs = [(numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int))]
+        for column in range(start, stop, end - start):
+            r = numpy.dot(standardized, matrix.standardize(column, min(column + end - start, stop)).T)
+
+            rows, cols = numpy.nonzero(r ** 2 >= r2)
+            rows += start
+            cols += column
+
+            keep = cols > rows
+            if window is not None:
+                keep &= cols - rows <= window
+
+            pairs.append((rows[keep], cols[keep]))
+
+        return numpy.concatenate([rows for rows, _ in pairs]), numpy.concatenate([cols for _, cols in pairs])
+
+    def _select_linkage(self, snps, selector="maf", selector_list=None):
+
+        """
+        Select SNPs in LD by rank of selectors: the best ranked SNP is retained and all SNPs in LD with it are removed,
+        then the next best ranked SNP not yet removed and so on.
+
+        """
+
+        rows, cols = self.linked
+
+        linked = numpy.unique(numpy.concatenate([rows, cols]))
+
+        if len(linked) == 0:
+            return
+
+        selectors = self._get_selectors([snps[i] for i in linked], selector=selector, selector_list=selector_list)
+        ranked = linked[self._rank_members(numpy.zeros(len(linked), dtype=int), selectors)]
+
+        # Neighbours of each SNP from pairs in both directions:
+        sources = numpy.concatenate([rows, cols])
+        targets = numpy.concatenate([cols, rows])[numpy.argsort(sources, kind="mergesort")]
+        offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(sources, minlength=len(snps)))])
+
+        removed = numpy.zeros(len(snps), dtype=bool)
+        retained = []
+
+        for i in ranked:
+            if removed[i]:
+                continue
+            retained.append(i)
+            removed[targets[offsets[i]:offsets[i + 1]]] = True
+
+        self.retained_linked += [snps[i] for i in retained]
+        self.removed_linked += [snps[i] for i in numpy.flatnonzero(removed)]
+
+    def _get_sequences(self, target="allele_seq_ref"):
+
+        return {snp_id: entry[target] for snp_id, entry in self.data.items()}
+
+    def _find_clusters(self, sequences, identity=0.95, word_size=10, description_length=0, cdhit_path=None,
+                       threads=1, memory=800):
+
+        """
+        Clusters the reference allele sequences with CDHIT-EST and parses the clusters for selecting and
+        retaining best sequences.
+
+        CD-HIT returns slightly different cluster configurations for each run due to greedy incremental algorithm,
+        but little variation observed between runs in the data for P. monodon. Know thyself!
+
+        """
+
+        os.makedirs(self.tmp_path, exist_ok=True)
+
+        fasta_path = self._write_fasta(sequences)
+
+        cluster_path = self._run_cdhit(fasta_path=fasta_path, identity=identity, word_size=word_size,
+                                       description_length=description_length, cdhit_path=cdhit_path,
+                                       threads=threads, memory=memory)
+
+        clusters = self._parse_cdhit(cluster_path)
+
+        if self.tmp_remove:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+        return clusters
+
+    @staticmethod
+    def _find_kmer_clusters(sequences, identity=0.95, threads=1):
+
+        """
+        Clusters the reference allele sequences in-process with k-mer sketches and exact verification of identity,
+        deterministic alternative to CD-HIT-EST that links all pairs of sequences at identity (single linkage).
+
+        """
+
+        stamp("Clustering sequences at identity", identity, "with k-mer engine on", threads, "processes")
+
+        clusterer = KmerClusterer(identity=identity, threads=threads)
+
+        return clusterer.cluster(sequences)
+
+    @staticmethod
+    def _collapse_sequences(sequences):
+
+        """
+        Collapse identical sequences to the first SNP with the sequence as representative, returns dictionary of
+        unique sequences {representative: sequence} and multiplicity of representatives {representative: snp_ids}.
+
+        """
+
+        representatives = {}
+        multiplicity = {}
+
+        for snp_id, sequence in sequences.items():
+            representative = representatives.setdefault(sequence, snp_id)
+            multiplicity.setdefault(representative, []).append(snp_id)
+
+        unique_sequences = {representative: sequence for sequence, representative in representatives.items()}
+
+        return unique_sequences, multiplicity
+
+    @staticmethod
+    def _expand_clusters(clusters, multiplicity):
+
+        """
+        Expand clusters of unique sequences to all SNPs with identical sequences, SNPs with identical sequences of
+        representatives outside of clusters form additional clusters.
+
+        """
+
+        expanded = {}
+        clustered = set()
+
+        for cluster_id, representatives in clusters.items():
+            expanded[cluster_id] = [snp_id for representative in representatives
+                                    for snp_id in multiplicity[representative]]
+            clustered.update(representatives)
+
+        cluster_id = max(expanded.keys()) if expanded else 0
+        for representative, snp_ids in multiplicity.items():
+            if len(snp_ids) > 1 and representative not in clustered:
+                cluster_id += 1
+                expanded[cluster_id] = snp_ids
+
+        return expanded
+
+    @staticmethod
+    def _restrict_clusters(clusters, sequences):
+
+        """ Restrict clusters to members in sequences, retaining clusters with more than one member. """
+
+        restricted = {}
+        for cluster_id, members in clusters.items():
+            members = [member for member in members if member in sequences]
+            if len(members) > 1:
+                restricted[int(cluster_id)] = members
+
+        return restricted
+
+    @staticmethod
+    def _get_cache_parameters(identity, word_size, engine):
+
+        """ Parameters of the clustering engine in the cache key, the k-mer engine does not use the word size. """
+
+        parameters = {"engine": engine, "identity": identity}
+        if engine == "cdhit":
+            parameters["word_size"] = word_size
+
+        return parameters
+
+    def _get_cache_prefix(self, identity, word_size, engine):
+
+        """ Prefix of cache files named by the hash of the engine parameters. """
+
+        parameters = self._get_cache_parameters(identity, word_size, engine)
+
+        return "clusters_" + hashlib.sha1(json.dumps(parameters, sort_keys=True).encode("utf-8")).hexdigest()[:16] + "_"
+
+    def _get_cache_file(self, sequences, identity, word_size, engine):
+
+        """
+        Content-addressed cache file named by the hash of the engine parameters and the hash of the sorted
+        (ID, sequence) pairs, so that an exact cache entry is found by its name and entries with the same parameters
+        by the prefix of their name.
+
+        """
+
+        digest = hashlib.sha1()
+        for snp_id in sorted(sequences.keys()):
+            digest.update((snp_id + "\t" + sequences[snp_id] + "\n").encode("utf-8"))
+
+        return os.path.join(self.cache_path, self._get_cache_prefix(identity, word_size, engine) + digest.hexdigest() +
+                            ".json")
+
+    def _read_cluster_cache(self, sequences, identity=0.95, word_size=10, engine="cdhit"):
+
+        """
+        Read cluster assignments for the same sequences and parameters from cache. If there is no entry for exactly
+        the same sequences, clusters of the smallest cached superset of the sequences (same IDs and sequences) are
+        restricted to the sequences, in the same way as clusters from the background are restricted to the SNPs
+        retained by filters. Returns None if there is no cache entry.
+
+        """
+
+        cache_file = self._get_cache_file(sequences, identity, word_size, engine)
+
+        if os.path.exists(cache_file):
+            stamp("Reading sequence clusters from cache:", cache_file)
+
+            with open(cache_file, "r") as cache:
+                return {int(cluster_id): members for cluster_id, members in json.load(cache)["clusters"].items()}
+
+        if not os.path.isdir(self.cache_path):
+            return None
+
+        prefix = self._get_cache_prefix(identity, word_size, engine)
+
+        superset_file, superset_size, clusters = None, None, None
+        for file_name in sorted(os.listdir(self.cache_path)):
+            if not file_name.startswith(prefix):
+                continue
+
+            with open(os.path.join(self.cache_path, file_name), "r") as cache:
+                cached = json.load(cache)
+
+            if len(sequences) < cached["snps"] and (superset_size is None or cached["snps"] < superset_size) and \
+                    all(cached["sequences"].get(snp_id) == sequence for snp_id, sequence in sequences.items()):
+                superset_file, superset_size, clusters = file_name, cached["snps"], cached["clusters"]
+
+        if clusters is None:
+            return None
+
+        stamp("Restricting sequence clusters of", superset_size, "SNPs from cache:",
+              os.path.join(self.cache_path, superset_file))
+
+        return self._restrict_clusters(clusters, sequences)
+
+    def _write_cluster_cache(self, sequences, clusters, identity=0.95, word_size=10, engine="cdhit"):
+
+        """ Write cluster assignments with parameters and sequences to cache. """
+
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        cache_file = self._get_cache_file(sequences, identity, word_size, engine)
+
+        cached = dict(self._get_cache_parameters(identity, word_size, engine), snps=len(sequences), clusters=clusters,
+                      sequences=sequences)
+
+        with open(cache_file, "w") as cache:
+            json.dump(cached, cache)
+
+        stamp("Writing sequence clusters to cache:", cache_file)
+
+        return cache_file
+
+    def _select_clusters(self, selector="maf", selector_list=None):
+
+        """ Select best markers from clusters by selector. """
+
+        retained, removed = self._select_groups(self.clusters, selector=selector, selector_list=selector_list)
+
+        self.retained_sequences += retained
+        self.removed_sequences += removed
+
+    def _write_fasta(self, sequences):
+
+        """ Write fasta file of sequences with SNP IDs for CD-HIT. """
+
+        file_name = os.path.join(self.tmp_path, self.project + "_Seqs")
+
+        file_name += ".fasta"
+
+        write_fasta(sequences.items(), file_name)
+
+        return file_name
+
+    def _run_cdhit(self, fasta_path, identity=0.95, word_size=5, description_length=0, cdhit_path=None, threads=1,
+                   memory=800):
+
+        """
+        Run CDHIT-EST for sequences, install with sudo apt install cd-hit on Ubuntu. Threads (-T, 0 for all cores)
+        and memory limit in MB (-M, 0 for unlimited) are passed to CD-HIT.
+
+        """
+
+        self.messages.get_cdhit_message(identity)
+
+        if cdhit_path is None:
+            cdhit_path = "cd-hit-est"
+
+        file_name = self.project + "_IdentityClusters_" + str(identity)
+
+        out_file = os.path.join(self.tmp_path, file_name)
+        cluster_path = os.path.join(self.tmp_path, file_name + '.clstr')
+
+        stamp("Calling cd-hit-est: " + cdhit_path + " -i " + fasta_path + " -o " + out_file + " -c " + str(identity) +
+              " -n " + str(word_size) + " -d " + str(description_length) + " -T " + str(threads) + " -M " + str(memory))
+
+        with open(os.devnull, "w") as devnull:
+            call([cdhit_path, "-i", fasta_path, "-o", out_file, "-c", str(identity), "-n", str(word_size),
+                  "-d", str(description_length), "-T", str(threads), "-M", str(memory)], stdout=devnull)
+
+        return cluster_path
+
+    def _parse_cdhit(self, file):
+
+        """
+        Parses the CDHIT cluster output and retains only cluster with more than one sequence for selection and
+        removal from total SNPs in dictionary: {cluster_id: snp_ids}
+
+        """
+
+        identity_clusters = {}
+
+        with open(file, "r") as clstr_file:
             nrows = len(list(clstr_file))
 
         with open(file, "r") as clstr_file:
@@ -706,34 +1716,77 @@ class RedundancyModule(QualityControl):
 
         """ Select best SNP from duplicate clusters. """
 
-        for clone, clone_data in self.duplicates.items():
-            best_clone = self._compare_entries(clone_data["allele_ids"], selector=selector, selector_list=selector_list)
-            self.retained_duplicates.append(best_clone)
-            self.removed_duplicates += [marker for marker in clone_data["allele_ids"] if marker != best_clone]
+        groups = {clone: clone_data["allele_ids"] for clone, clone_data in self.duplicates.items()}
 
-    def _compare_entries(self, ids, selector="maf", selector_list=None):
+        retained, removed = self._select_groups(groups, selector=selector, selector_list=selector_list)
 
-        """
-        Gets data from dictionary for each duplicate SNP according to 'selector'
-        and returns the allele identification of the best entry.
+        self.retained_duplicates += retained
+        self.removed_duplicates += removed
 
-        Selector list currently sorts descending, that is all selector values must be ranked highest value ("best") -
-        this is the case for MAF, Call Rate, Rep, Read Counts ...
+    def _select_groups(self, groups, selector="maf", selector_list=None):
 
-        Later rank the data by QC Score.
+        """
+        Select the best SNP of each group (dictionary of group: snp_ids) by selector or list of selectors from data,
+        returns lists of retained and removed SNP IDs.
 
         """
 
+        snp_ids = [snp_id for members in groups.values() for snp_id in members]
+        labels = numpy.repeat(numpy.arange(len(groups)), [len(members) for members in groups.values()])
+
+        selectors = self._get_selectors(snp_ids, selector=selector, selector_list=selector_list)
+
+        retained, removed = self._select_best(labels, selectors)
+
+        return [snp_ids[i] for i in retained], [snp_ids[i] for i in removed]
+
+    def _get_selectors(self, snp_ids, selector="maf", selector_list=None):
+
+        """ Selector values from data as array (SNPs x selectors). """
+
         if selector_list is None:
-            entries_stats = [[i, self.data[i][selector]] for i in ids]
-            entries_ranked = sorted(entries_stats, key=operator.itemgetter(1), reverse=True)
-        else:
-            entries_stats = [[i] + [self.data[i][selector] for selector in selector_list] for i in ids]
-            entries_ranked = sorted(entries_stats,
-                                    key=operator.itemgetter(*[i for i in range(1, len(selector_list) + 1)]),
-                                    reverse=True)
+            selector_list = [selector]
+
+        return numpy.array([[self.data[snp_id][s] for s in selector_list] for snp_id in snp_ids],
+                           dtype=float).reshape(len(snp_ids), len(selector_list))
+
+    @staticmethod
+    def _select_best(labels, selectors):
+
+        """
+        Select the best member of each group in a single pass, returns arrays of retained and removed indices.
+
+        Labels are the group of each member, selectors (members x selectors) are ranked descending in order of columns,
+        that is all selector values must be ranked highest value ("best") - this is the case for MAF, Call Rate,
+        Rep, Read Counts or a composite QC Score. Ties are resolved by order of members.
+
+        """
+
+        labels = numpy.asarray(labels)
+
+        order = RedundancyModule._rank_members(labels, selectors)
+
+        ordered = labels[order]
+        best = numpy.ones(len(order), dtype=bool)
+        best[1:] = ordered[1:] != ordered[:-1]
+
+        return order[best], order[~best]
+
+    @staticmethod
+    def _rank_members(labels, selectors):
 
-        return entries_ranked[0][0]
+        """ Order of members by group and descending selectors within groups, ties by order of members. """
+
+        labels = numpy.asarray(labels)
+        selectors = numpy.asarray(selectors, dtype=float)
+
+        if selectors.ndim == 1:
+            selectors = selectors[:, None]
+
+        # Last key is the primary key in lexical sort, members with NaN are ranked last:
+        keys = [numpy.arange(len(labels))] + [-selectors[:, i] for i in reversed(range(selectors.shape[1]))] + [labels]
+
+        return numpy.lexsort(keys)
 
 
 ########################################################################################################################
@@ -744,13 +1797,9 @@ class CombinationModule:
 
     def __init__(self, marker_module):
 
-        if not marker_module.filters:
-            ValueError("Data must have been assessed and filtered with MarkerModule.")
-
-        self.filters = marker_module.filters
         self.data = marker_module.data
 
-    def get_matrix(self, parameter_one, parameter_two, values_one, values_two):
+    def get_matrix(self, parameter_one, parameter_two, values_one, values_two, comparisons=None):
 
         """"
         Pairwise analysis of two values given two parameters and value vectors, outputs data for visualization of
@@ -758,24 +1807,125 @@ class CombinationModule:
 
         """
 
+        cube = self.get_cube([parameter_one, parameter_two], [values_one, values_two], comparisons=comparisons)
+
         result_matrix = [[parameter_one + "/" + parameter_two] + values_one]
         r_matrix = []
 
-        try:
-            for value_y in values_two:
-                result_row = [value_y]
-                filtered_y = self.filters[parameter_two][value_y]
-                for value_x in values_one:
-                    filtered_x = self.filters[parameter_one][value_x]
-                    filter_combined = set(filtered_x + filtered_y)
-                    r_matrix += [[str(value_y), str(value_x), len(self.data) - len(filter_combined), 100, 100]]
-                    result_row.append(len(self.data) - len(filter_combined))  # Number of retained SNPs
-                result_matrix.append(result_row)
-
-            return result_matrix, r_matrix
+        for y, value_y in enumerate(values_two):
+            result_row = [value_y]
+            for x, value_x in enumerate(values_one):
+                retained = int(cube[x, y])  # Number of retained SNPs
+                r_matrix += [[str(value_y), str(value_x), retained, 100, 100]]
+                result_row.append(retained)
+            result_matrix.append(result_row)
+
+        return result_matrix, r_matrix
+
+    def get_cube(self, parameters, values, comparisons=None):
+
+        """
+        Parameter sweep across any number of SNP parameters and value vectors, returns an array with one axis per
+        parameter (same order as the value vectors) holding the number of retained SNPs for each combination.
+
+        Each SNP is ranked once against the sorted thresholds of each parameter, the ranks are counted into a
+        histogram over the cube and retained SNPs are accumulated along each axis. Comparisons are the filter
+        comparisons used in SNPModule (<=, >= or ==, default <=), a threshold of None does not filter. As in
+        SNPModule.filter_data, SNPs with undefined statistics (NaN) fail every comparison and are always retained.
+
+        """
+
+        if comparisons is None:
+            comparisons = ["<="] * len(parameters)
 
+        if not len(parameters) == len(values) == len(comparisons):
+            raise ValueError("Parameters, value vectors and comparisons must have the same length.")
+
+        shape = [len(parameter_values) + 1 for parameter_values in values]
+
+        sorted_thresholds = [numpy.sort(self._get_thresholds(parameter_values, comparison))
+                             for parameter_values, comparison in zip(values, comparisons)]
+
+        ranks = [self._rank_statistic(self._get_statistic(parameter), thresholds, comparison)
+                 for parameter, thresholds, comparison in zip(parameters, sorted_thresholds, comparisons)]
+
+        if self.data:
+            cells = numpy.ravel_multi_index(ranks, shape)
+        else:
+            cells = numpy.zeros(0, dtype=int)
+
+        cube = numpy.bincount(cells, minlength=int(numpy.prod(shape))).reshape(shape)
+
+        for axis, (parameter_values, comparison) in enumerate(zip(values, comparisons)):
+            if comparison == "<=":
+                # Retained if statistic > threshold: SNPs ranked above the threshold
+                cube = numpy.flip(numpy.cumsum(numpy.flip(cube, axis), axis=axis), axis)
+                cube = numpy.take(cube, numpy.arange(1, len(parameter_values) + 1), axis=axis)
+            elif comparison == ">=":
+                # Retained if statistic < threshold: SNPs ranked at or below the threshold
+                cube = numpy.take(numpy.cumsum(cube, axis=axis), numpy.arange(len(parameter_values)), axis=axis)
+            else:
+                # Retained if statistic != threshold: all SNPs except those ranked at the first equal threshold
+                first = numpy.searchsorted(sorted_thresholds[axis], sorted_thresholds[axis], side="left")
+                cube = numpy.sum(cube, axis=axis, keepdims=True) - numpy.take(cube, first, axis=axis)
+
+            # Back to order of value vector:
+            order = numpy.argsort(self._get_thresholds(parameter_values, comparison), kind="mergesort")
+            cube = numpy.take(cube, numpy.argsort(order, kind="mergesort"), axis=axis)
+
+        return cube
+
+    @staticmethod
+    def get_cube_matrix(parameters, values, cube):
+
+        """ Long format of parameter cube for output with SummaryModule, one row per combination of values. """
+
+        result_matrix = [list(parameters) + ["retained"]]
+        r_matrix = []
+
+        for index in numpy.ndindex(*cube.shape):
+            combination = [parameter_values[i] for parameter_values, i in zip(values, index)]
+            retained = int(cube[index])
+            result_matrix.append(combination + [retained])
+            r_matrix.append([str(value) for value in combination] + [retained, 100, 100])
+
+        return result_matrix, r_matrix
+
+    def _get_statistic(self, parameter):
+
+        try:
+            return numpy.array([data[parameter] for data in self.data.values()], dtype=float)
         except KeyError:
-            "Can't find parameter or specified value in marker filters, please use MarkerModule"
+            raise ValueError("Can't find parameter " + str(parameter) + " in SNP data, please use SNPModule")
+
+    @staticmethod
+    def _get_thresholds(parameter_values, comparison):
+
+        if comparison not in ("<=", ">=", "=="):
+            raise ValueError("Comparison must be one of: <=, >=, ==")
+
+        # None does not remove any SNPs
+        unset = {"<=": -numpy.inf, ">=": numpy.inf, "==": numpy.nan}[comparison]
+
+        return numpy.array([unset if value is None else value for value in parameter_values], dtype=float)
+
+    @staticmethod
+    def _rank_statistic(statistic, thresholds, comparison):
+
+        """ Rank of each SNP statistic against the sorted thresholds of a parameter. """
+
+        if comparison == "==":
+            # Index of the first equal threshold, past all thresholds if there is none
+            ranks = numpy.searchsorted(thresholds, statistic, side="left")
+            inside = ranks < len(thresholds)
+            equal = numpy.zeros(len(statistic), dtype=bool)
+            equal[inside] = thresholds[ranks[inside]] == statistic[inside]
+            ranks = numpy.where(equal, ranks, len(thresholds))
+        else:
+            ranks = numpy.searchsorted(thresholds, statistic, side="left" if comparison == "<=" else "right")
+
+        # NaN fails every comparison, rank it where it is retained at all thresholds
+        return numpy.where(numpy.isnan(statistic), 0 if comparison == ">=" else len(thresholds), ranks)
 
 
 class SNPModule(QualityControl):
@@ -885,92 +2035,128 @@ class SNPModule(QualityControl):
 
     # Private functions for parameter calculations
 
-    def _calculate_maf(self, snp, genotypes):
+    @staticmethod
+    def _calculate_maf(p, q, called):
 
         """
-        Calculates minor allele frequency for a single SNP. Pass a one-row format list (zip on double-row)
-        of allele calls. Returns the minimum allele frequency for processing.
+        Calculates minor allele frequency across SNPs from observed allele frequencies. Returns zero for SNPs with
+        complete missing data.
         """
 
-        if self.sample_size != len(genotypes):
-            print("Warning: Number of samples does not correspond number of allele calls.")
+        with numpy.errstate(invalid="ignore"):
+            return numpy.where(called > 0, numpy.minimum(p, q), 0)
 
-        adjusted_samples = self.sample_size - genotypes.count(self.missing)
+    @staticmethod
+    def _calculate_hwe(observed, p, q, called):
 
-        het_count = genotypes.count(self.heterozygous)
+        """
+        Calculates p-value for HWE using ChiSquare statistic: get observed counts, get expected counts from observed
+        frequencies, calculate test values using (O-E)**2 / E and return ChiSquare probability with 1 degree of
+        Freedom (bi-allelic SNP). Returns zero if any expected count is zero (monomorphic or missing SNPs).
 
-        try:
-            freq_allele_one = (genotypes.count(self.homozygous_major) + (het_count / 2)) / adjusted_samples
-            freq_allele_two = (genotypes.count(self.homozygous_minor) + (het_count / 2)) / adjusted_samples
-        except ZeroDivisionError:
-            # print("Detected complete missing data in SNP:", snp)
-            return 0
+        """
 
-        return min(freq_allele_one, freq_allele_two)
+        expected = SNPModule._get_expected(p, q, called)
 
-    def _calculate_hwe(self, snp, genotypes):
+        valid = (called > 0) & numpy.all(expected > 0, axis=-1)
 
-        """
-        Calculates p-value for HWE using ChiSquare statistic: remove missing, get observed counts, get observed
-        frequencies, get expected counts, calculate test values using (O-E)**2 / E and return ChiSquare probability
-        with 1 degree of Freedom (bi-allelic SNP).
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            chi_square = (((observed - expected) ** 2) / expected).sum(axis=-1)
 
-        """
+        return numpy.where(valid, stats.chi2.sf(numpy.where(valid, chi_square, 0), 1), 0)
 
-        adjusted_samples = self.sample_size - genotypes.count(self.missing)
-        hetero_obs, major_obs, minor_obs = self._get_observed(genotypes)
+    @staticmethod
+    def _get_expected(p, q, called):
 
-        try:
-            p = (major_obs + (hetero_obs / 2)) / adjusted_samples
-            q = (minor_obs + (hetero_obs / 2)) / adjusted_samples
-        except ZeroDivisionError:
-            # print("Detected complete missing data in SNP:", snp)
-            return 0
+        """ Get expected counts under HWE (heterozygous, homozygous major, homozygous minor) """
 
-        if (p + q) != 1:
-            ValueError("Sum of observed allele frequencies (p + q) does not equal one.")
+        return numpy.stack([called * (2 * p * q), called * (p ** 2), called * (q ** 2)], axis=-1)
 
-        hetero_exp, major_exp, minor_exp = self._get_expected(p, q, adjusted_samples)
+    @staticmethod
+    def _calculate_call(missing, sample_size):
 
-        try:
-            hetero_test = ((hetero_obs - hetero_exp) ** 2) / hetero_exp
-            major_test = ((major_obs - major_exp) ** 2) / major_exp
-            minor_test = ((minor_obs - minor_exp) ** 2) / minor_exp
-        except ZeroDivisionError:
-            return 0
+        """ Calculates call rate across samples for each SNP. """
 
-        return stats.chisqprob(sum([hetero_test, major_test, minor_test]), 1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(sample_size > 0, 1 - (missing / sample_size), 0)
 
-    def _get_observed(self, genotypes):
+    @staticmethod
+    def _calculate_heterozygosity(het, p, q, called):
+
+        """ Observed and expected (2pq) heterozygosity across SNPs, zero for SNPs with complete missing data. """
 
-        """" Get observed counts in the genotype for each SNP """
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            observed = numpy.where(called > 0, het / called, 0)
+            expected = numpy.where(called > 0, 2 * p * q, 0)
 
-        return genotypes.count(self.heterozygous), genotypes.count(self.homozygous_major), \
-               genotypes.count(self.homozygous_minor)
+        return observed, expected
 
     @staticmethod
-    def _get_expected(p, q, adjusted_samples):
+    def _calculate_pic(p, q, called):
 
-        """ Get expected counts under HWE """
+        """ Polymorphism information content for bi-allelic SNPs: 1 - (p^2 + q^2) - 2p^2q^2 """
 
-        return adjusted_samples * (2 * p * q), adjusted_samples * (p ** 2), adjusted_samples * (q ** 2)
+        with numpy.errstate(invalid="ignore"):
+            return numpy.where(called > 0, 1 - (p ** 2 + q ** 2) - 2 * (p ** 2) * (q ** 2), 0)
 
-    def _calculate_call(self, genotypes):
+    @staticmethod
+    def _calculate_fis(observed, expected):
 
-        """ Calculates call rate across samples for a single SNP. """
+        """ Inbreeding coefficient F_IS = 1 - Ho / He, zero for monomorphic SNPs. """
 
-        return 1 - (genotypes.count(self.missing) / self.sample_size)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(expected > 0, 1 - observed / expected, 0)
+
+    @staticmethod
+    def _calculate_statistics(counts, sample_size):
+
+        """
+        Calculate all SNP statistics from an array of genotype counts (SNPs x 4 or SNPs x populations x 4) from
+        GenotypeMatrix, returns dictionary of statistics and arrays of values across SNPs (and populations).
+        """
+
+        het, minor, major, missing = [counts[..., i].astype(float) for i in range(4)]
+
+        sample_size = numpy.asarray(sample_size, dtype=float)
+        called = sample_size - missing
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            p = (major + (het / 2)) / called
+            q = (minor + (het / 2)) / called
+
+        observed = numpy.stack([het, major, minor], axis=-1)
+
+        ho, he = SNPModule._calculate_heterozygosity(het, p, q, called)
+
+        return {
+            "maf": SNPModule._calculate_maf(p, q, called),
+            "call_rate": SNPModule._calculate_call(missing, sample_size),
+            "hwe": SNPModule._calculate_hwe(observed, p, q, called),
+            "ho": ho,
+            "he": he,
+            "pic": SNPModule._calculate_pic(p, q, called),
+            "fis": SNPModule._calculate_fis(ho, he),
+            "allele_count_major": (2 * major + het).astype(int),
+            "allele_count_minor": (2 * minor + het).astype(int)
+        }
 
     def _calculate_parameters(self):
 
         """
-        Calculate minor allele frequency, call rate and chi-square probability for HWE for each SNP and decorate
-        the data dictionary for statistics across SNPs.
+        Calculate minor allele frequency, call rate, chi-square probability for HWE, observed and expected
+        heterozygosity, PIC, inbreeding coefficient and allele counts for each SNP from a single counting pass over
+        the genotype matrix and decorate the data dictionary for statistics across SNPs.
         """
 
-        for snp, data in self.data.items():
-            self.data[snp]["maf"] = self._calculate_maf(snp, data["calls"])
-            self.data[snp]["call_rate"] = self._calculate_call(data["calls"])
-            self.data[snp]["hwe"] = self._calculate_hwe(snp, data["calls"])
+        matrix = GenotypeMatrix(self.data, self.attributes)
+
+        if self.sample_size != matrix.codes.shape[1]:
+            print("Warning: Number of samples does not correspond number of allele calls.")
+
+        statistics = self._calculate_statistics(matrix.counts(), self.sample_size)
+
+        for parameter, values in statistics.items():
+            for snp, value in zip(matrix.snps, values.tolist()):
+                self.data[snp][parameter] = value
 
 ########################################################################################################################
@@ -27,7 +27,8 @@ class Preprocessor(DartReader):
 
         self.call_names = call_attributes["sample_names"]
 
-        self.replicates = {}
+        self.counts = None  # Read counts summed over replicates (SNPs x samples x alleles)
+        self.count_snps = []
 
         self._set_log()
 
@@ -39,18 +40,20 @@ class Preprocessor(DartReader):
             "states": {}  # States are other parameters of interest not necessary results or settings.
         }
 
-    def get_replicates(self):
+    @staticmethod
+    def get_replicates(sample_names):
 
         """
-        Get replicate indices across individuals for summation of read calls.
+        Get replicate indices across individuals for summation of read calls, returns dictionary of sample names
+        and column indices.
 
         """
 
-        for i, sample in enumerate(self.sample_names):
-            if sample not in self.replicates.keys():
-                self.replicates[sample] = [i]
-            else:
-                self.replicates[sample] += [i]
+        replicates = {}
+        for i, sample in enumerate(sample_names):
+            replicates.setdefault(sample, []).append(i)
+
+        return replicates
 
     def read_count_data(self, file):
 
@@ -124,25 +127,11 @@ class Preprocessor(DartReader):
         snp_order = sorted(self.data.keys())
         reduced_counts = {}
 
-        stamp("Finding replicate columns...")
-
-        self.get_replicates()
-
-        stamp("Ordering count data by SNPs...")
-
-        counts = [self.data[snp]["calls"] for snp in snp_order]
-
-        count_array = numpy.asarray(counts)
-
         stamp("Sum-collapsing replicates...")
 
-        for idx, aCounts in enumerate(count_array):
-            if len(aCounts) < 2:
-                raise SimpleException("Invalid read counts data for allele " + snp_order[idx] + " - is there only 1 row?")
-
-        columns = [numpy.sum(count_array[:, self.replicates[sample]], axis=1).tolist() for sample in self.call_names]
+        self.count_snps, _, self.counts = self.sum_replicates(self.data, self.sample_names, self.call_names)
 
-        reduced_array = list(zip(*columns))
+        reduced_array = self.counts.tolist()
 
         for i, snp in enumerate(snp_order):
             reduced_counts[snp] = reduced_array[i]
@@ -214,3 +203,36 @@ class Preprocessor(DartReader):
 
     def get_filtered(self):
         return self.filtered
+
+    @staticmethod
+    def sum_replicates(count_data, count_names, call_names):
+
+        """
+        Sum read counts of count data over the replicate columns of each sample in the call data, returns read counts
+        as get_counts with SNPs ordered by ID.
+
+        """
+
+        replicates = Preprocessor.get_replicates(count_names)
+
+        snp_order = sorted(count_data.keys())
+
+        count_array = numpy.asarray([count_data[snp]["calls"] for snp in snp_order])
+
+        for idx, aCounts in enumerate(count_array):
+            if len(aCounts) < 2:
+                raise SimpleException("Invalid read counts data for allele " + snp_order[idx] + " - is there only 1 row?")
+
+        counts = numpy.stack([numpy.sum(count_array[:, replicates[sample]], axis=1) for sample in call_names], axis=1)
+
+        return snp_order, call_names, counts
+
+    def get_counts(self):
+
+        """
+        Read counts summed over replicates, tuple of SNP IDs, sample names and array (SNPs x samples x (reference,
+        alternative)) for DartWriter.write_store and DartWriter.write_vcf.
+
+        """
+
+        return self.count_snps, self.call_names, self.counts
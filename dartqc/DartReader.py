@@ -2,7 +2,10 @@ import os
 import csv
 import json
 
+import numpy
+
 from dartqc.SimpleException import SimpleException
+from dartqc.DartMatrix import CallRow
 
 
 class DartReader:
@@ -316,6 +319,124 @@ class DartReader:
 
         return data, attributes
 
+    def read_ndjson(self, data_file, batch_size=10000):
+
+        """
+        Read data and attributes from line-delimited JSON written by DartWriter.write_ndjson, decoding batches of SNP
+        records into the data dictionary. The whole data dictionary is built in memory as by read_json, so peak memory
+        is about the same as for JSON.
+
+        """
+
+        attributes = self.read_ndjson_attributes(data_file)
+
+        data = {}
+        for batch in self.iter_ndjson(data_file, batch_size=batch_size):
+            data.update(batch)
+
+        return data, attributes
+
+    @staticmethod
+    def read_ndjson_attributes(data_file):
+
+        """ Attributes from the header line of line-delimited JSON. """
+
+        with open(data_file) as data_in:
+            header = json.loads(data_in.readline() or "{}")
+
+        if "attributes" not in header:
+            raise SimpleException("Line-delimited JSON " + data_file + " does not start with a header of attributes.")
+
+        return header["attributes"]
+
+    @staticmethod
+    def iter_ndjson(data_file, batch_size=10000):
+
+        """
+        Generator of batches of SNP records (dictionaries of SNP ID: data) from line-delimited JSON, skipping the
+        header line. Each batch of lines is decoded in a single call as JSON array.
+
+        """
+
+        with open(data_file) as data_in:
+            data_in.readline()
+
+            lines = []
+            for line in data_in:
+                if line.strip():
+                    lines.append(line)
+
+                if len(lines) >= batch_size:
+                    yield {record["id"]: record["data"] for record in json.loads("[" + ",".join(lines) + "]")}
+                    lines = []
+
+            if lines:
+                yield {record["id"]: record["data"] for record in json.loads("[" + ",".join(lines) + "]")}
+
+    def read_store(self, store_path):
+
+        """
+        Read data and attributes from a binary project store written by DartWriter.write_store. The genotype matrix is
+        memory-mapped and the calls of each SNP are a view of its row (CallRow), which is decoded lazily and passed to
+        GenotypeMatrix as codes.
+
+        """
+
+        with open(os.path.join(store_path, "store.json")) as store_in:
+            store = json.load(store_in)
+
+        with open(os.path.join(store_path, "attributes.json")) as attr_in:
+            attributes = json.load(attr_in)
+
+        codes = numpy.load(os.path.join(store_path, "genotypes.npy"), mmap_mode="r")
+        snps = numpy.load(os.path.join(store_path, "snps.npy")).tolist()
+        attributes["sample_names"] = numpy.load(os.path.join(store_path, "samples.npy")).tolist()
+
+        symbols = [attributes["heterozygous"], attributes["homozygous_minor"], attributes["homozygous_major"],
+                   attributes["missing"]]
+
+        columns = {key: self._read_column(os.path.join(store_path, "columns", key + ".npy"), kind)
+                   for key, kind in store["columns"].items()}
+
+        data = {}
+        for i, snp in enumerate(snps):
+            entry = {key: column[i] for key, column in columns.items()}
+            entry["calls"] = CallRow(codes[i], symbols)
+            data[snp] = entry
+
+        return data, attributes
+
+    @staticmethod
+    def read_store_counts(store_path):
+
+        """
+        Read counts from a binary project store as tuple of SNP IDs, sample names and memory-mapped array (SNPs x
+        samples x (reference, alternative)), or None if the store was written without read counts.
+
+        """
+
+        counts_file = os.path.join(store_path, "counts.npy")
+
+        if not os.path.exists(counts_file):
+            return None
+
+        snps = numpy.load(os.path.join(store_path, "snps.npy")).tolist()
+        samples = numpy.load(os.path.join(store_path, "samples.npy")).tolist()
+
+        return snps, samples, numpy.load(counts_file, mmap_mode="r")
+
+    @staticmethod
+    def _read_column(file, kind):
+
+        values = numpy.load(file).tolist()
+
+        if kind == "nullable":
+            return [None if value != value else value for value in values]  # NaN as missing value
+        if kind == "json":
+            return [json.loads(value) for value in values]
+
+        return values
+
     def get_data(self):
 
         attributes = {
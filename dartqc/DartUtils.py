@@ -206,6 +206,10 @@ class CommandLine:
         validate_parser.add_argument("--cdhit_path", type=lambda p: os.path.abspath(p), required=False,
                                      dest="cdhit_path", default="cd-hit-est",
                                      help="Path to the cdhit 2d executable (required if cd-hit-2d doesn't work on cmd line)")
+        validate_parser.add_argument("--cluster_engine", default="kmer", type=str, choices=["cdhit", "kmer"],
+                                     dest="cluster_engine", help="match sequences in-process (kmer) or with cd-hit-2d")
+        validate_parser.add_argument("--threads", "-t", default=1, type=int, dest="threads",
+                                     help="number of processes for matching sequences")
 
         validate_parser.set_defaults(subparser='validate')
 
@@ -233,13 +237,19 @@ class CommandLine:
         process_parser.add_argument("--graph", "-g", default=False, type=bool, required=False,
                                     dest="graph", help="Create graphs")
 
+        process_parser.add_argument("--json", default=False, action="store_true", dest="json",
+                                    help="export data and attributes as json in addition to the binary project store")
+        process_parser.add_argument("--ndjson", default=False, action="store_true", dest="ndjson",
+                                    help="export data and attributes as line-delimited json (one snp per line)")
+
         process_parser.set_defaults(subparser='process')
 
         filter_parser = subparsers.add_parser("filter")
 
         filter_parser.add_argument("--processed", "--pp", type=lambda p: os.path.abspath(p), required=False,
                                    dest="processed_path", default=None,
-                                   help="input path to processed data files (project_data.json, project_attr.json)")
+                                   help="input path to processed data (project_store or project_data.json, "
+                                        "project_attr.json)")
 
         filter_parser.add_argument("--calls", "-c", default="calls.csv", type=lambda p: os.path.abspath(p),
                                    required=False, dest="call_file", help="path to called read file")
@@ -256,14 +266,46 @@ class CommandLine:
                                    dest="call_rate", help="filter snps <= call rate of snp")
         filter_parser.add_argument("--rep", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
                                    dest="rep", help="filter snps <= replication average of snp")
+        filter_parser.add_argument("--ho", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
+                                   dest="ho", help="filter snps <ho_comparison> observed heterozygosity")
+        filter_parser.add_argument("--ho_comparison", default=">=", choices=["<=", ">=", "=="],
+                                   dest="ho_comp", help="comparison of --ho, <=, >= or == ('>=')")
+        filter_parser.add_argument("--he", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
+                                   dest="he", help="filter snps <he_comparison> expected heterozygosity")
+        filter_parser.add_argument("--he_comparison", default=">=", choices=["<=", ">=", "=="],
+                                   dest="he_comp", help="comparison of --he, <=, >= or == ('>=')")
+        filter_parser.add_argument("--pic", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
+                                   dest="pic", help="filter snps <pic_comparison> polymorphism information content")
+        filter_parser.add_argument("--pic_comparison", default="<=", choices=["<=", ">=", "=="],
+                                   dest="pic_comp", help="comparison of --pic, <=, >= or == ('<=')")
+        filter_parser.add_argument("--fis", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
+                                   dest="fis", help="filter snps <fis_comparison> inbreeding coefficient")
+        filter_parser.add_argument("--fis_comparison", default=">=", choices=["<=", ">=", "=="],
+                                   dest="fis_comp", help="comparison of --fis, <=, >= or == ('>=')")
 
         filter_parser.add_argument("--mind", default=[], type=lambda s: [float(item.strip()) if len(item.strip()) > 0 else None for item in s[1:-1].split(',')],
                                    dest="mind", help="filter samples > missingness per sample")
+        filter_parser.add_argument("--converge", default=False, action="store_true", dest="converge",
+                                   help="alternate --mind and --call_rate filters (first values) until convergence")
+        filter_parser.add_argument("--duplicate_samples", default=None, type=float, dest="duplicate_samples",
+                                   help="remove one sample of each pair with concordance >= threshold across snps")
+        filter_parser.add_argument("--threads", "-t", default=1, type=int, dest="threads",
+                                   help="number of threads for sample pair comparisons, sequence clustering and "
+                                        "output writers")
         filter_parser.add_argument("--mono", default=None,
                                    dest="mono", help="filter samples monomorphic in <mono> populations ('all', int)")
         filter_parser.add_argument("--mono_comparison", default="==",
                                    dest="mono_comp", help="filter samples monomorphic in >=, <=, == populations ('==')")
 
+        filter_parser.add_argument("--pop_hwe", default=None, type=float,
+                                   dest="pop_hwe", help="filter snps <= p-value of hardy-weinberg test within "
+                                                        "<pop_hwe_min> populations, needs --pop")
+        filter_parser.add_argument("--pop_hwe_min", default=1, type=int,
+                                   dest="pop_hwe_min", help="number of populations in which snps must fail --pop_hwe (1)")
+
+        filter_parser.add_argument("--fst", default=False, action="store_true", dest="fst",
+                                   help="calculate pairwise fst between populations after filtering, needs --pop")
+
         filter_parser.add_argument("--split_clones", default="", type=str, dest="split_clones",
                                    help="split clone ids on this character")
 
@@ -273,6 +315,30 @@ class CommandLine:
                                    dest="remove_clusters", help="remove snps in identical sequence clusters")
         filter_parser.add_argument("--identity", default=0.95, type=float,
                                    dest="identity", help="remove snps in identical sequence clusters")
+        filter_parser.add_argument("--cluster_engine", default="cdhit", type=str, choices=["cdhit", "kmer"],
+                                   dest="cluster_engine", help="engine for sequence clusters: cd-hit-est or k-mer")
+        filter_parser.add_argument("--no_cluster_cache", default=True, action="store_false",
+                                   dest="cluster_cache", help="do not read or write cached sequence clusters")
+        filter_parser.add_argument("--cdhit_memory", default=800, type=int, dest="cdhit_memory",
+                                   help="memory limit of cd-hit-est in MB, 0 for unlimited")
+
+        filter_parser.add_argument("--ld_r2", default=None, type=float, dest="ld_r2",
+                                   help="prune snps in linkage disequilibrium with r2 >= threshold")
+        filter_parser.add_argument("--ld_window", default=None, type=int, dest="ld_window",
+                                   help="number of following snps to compare in ld pruning, all if not specified")
+        filter_parser.add_argument("--ld_memory", default=1024, type=int, dest="ld_memory",
+                                   help="memory limit for blocks of ld pruning in MB")
+
+        filter_parser.add_argument("--plink_format", default="ped", type=str, choices=["ped", "bed"],
+                                   dest="plink_format", help="write filtered data as text (ped) or binary (bed) plink")
+        filter_parser.add_argument("--json", default=False, action="store_true", dest="json",
+                                   help="export data and attributes as json in addition to the binary project store")
+        filter_parser.add_argument("--ndjson", default=False, action="store_true", dest="ndjson",
+                                   help="export data and attributes as line-delimited json (one snp per line)")
+        filter_parser.add_argument("--vcf", default=False, action="store_true", dest="vcf",
+                                   help="export filtered data as vcf, with read depths if processed with read counts")
+        filter_parser.add_argument("--vcf_gzip", default=False, action="store_true", dest="vcf_gzip",
+                                   help="compress vcf with block-gzip across threads")
         filter_parser.add_argument("--cdhit_path", type=lambda p: os.path.abspath(p), required=False,
                                    dest="cdhit_path", default="cd-hit-est",
                                    help="Path to the cdhit executable (required if cd-hit-est doesn't work on cmd line)")
@@ -1,9 +1,185 @@
 import os
+import re
 import csv
+import zlib
 import numpy
 import json
+import time
+import struct
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 from dartqc.DartUtils import stamp
+from dartqc.DartMatrix import GenotypeMatrix, CallRow
+
+# PLINK .bed codes for genotype codes of GenotypeMatrix (allele 1 is the minor allele B):
+# heterozygous (10), homozygous minor (00), homozygous major (11), missing (01)
+BED_CODES = numpy.array([2, 0, 3, 1], dtype=numpy.uint8)
+BED_MAGIC = bytes([0x6C, 0x1B, 0x01])  # Magic number and SNP-major mode
+
+STORE_VERSION = 1  # Version of the binary project store
+NDJSON_VERSION = 1  # Version of line-delimited JSON
+
+# VCF genotypes for genotype codes of GenotypeMatrix (reference allele is the DArT reference, i.e. homozygous major):
+VCF_GENOTYPES = numpy.array(["0/1", "1/1", "0/0", "./."], dtype=object)
+VCF_SNP = re.compile(r"^(\d+):([A-Za-z]+)>([A-Za-z]+)")  # SNP column of DArT, e.g. 12:A>G
+
+
+class BlockGzipWriter:
+
+    """
+    Writer for block-gzip (BGZF) files readable by gzip, bgzip and tabix. Text is collected into blocks of at most
+    64 kB, batches of blocks are compressed across threads and written in order.
+
+    """
+
+    block_size = 65280
+    eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+    def __init__(self, file, threads=1, level=6):
+
+        self.file = open(file, "wb")
+        self.threads = threads
+        self.level = level
+
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+        self.buffer = []
+        self.buffer_length = 0
+        self.blocks = []
+
+    def write(self, text):
+
+        self.buffer.append(text.encode("utf-8"))
+        self.buffer_length += len(self.buffer[-1])
+
+        if self.buffer_length >= self.block_size:
+            data = b"".join(self.buffer)
+            end = (len(data) // self.block_size) * self.block_size
+
+            for start in range(0, end, self.block_size):
+                self.blocks.append(data[start:start + self.block_size])
+
+            rest = data[end:]
+            self.buffer = [rest]
+            self.buffer_length = len(rest)
+
+            if len(self.blocks) >= 4 * self.threads:
+                self._flush_blocks()
+
+    def close(self):
+
+        data = b"".join(self.buffer)
+        if data:
+            self.blocks.append(data)
+
+        self._flush_blocks()
+
+        self.file.write(self.eof)
+        self.file.close()
+        self.executor.shutdown()
+
+    def _flush_blocks(self):
+
+        for block in self.executor.map(self._compress, self.blocks):
+            self.file.write(block)
+
+        self.blocks = []
+
+    def _compress(self, data):
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        header = struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+        footer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+        return header + compressed + footer
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+def write_concurrent(writers, threads=None):
+
+    """
+    Run output writers (list of name, callable) in a thread pool, one thread per writer by default or sequentially with
+    one thread. Writers share the final data read-only and must not modify it. Returns dictionary of writer name:
+    seconds, errors of writers are raised after all writers finished.
+
+    Most of the work of the writers (JSON encoding, formatting of text rows) is Python code holding the GIL, so threads
+    only overlap file I/O and the parts in numpy and zlib that release the GIL: the output stage takes about as long as
+    the sum of the writers, not as long as the slowest writer. With more than one thread, the time of a writer includes
+    waiting for the other writers.
+
+    """
+
+    def timed(writer):
+        start = time.time()
+        writer()
+        return time.time() - start
+
+    threads = threads or max(len(writers), 1)
+
+    stamp("Running", len(writers), "output writers on", threads, "threads")
+
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [(name, executor.submit(timed, writer)) for name, writer in writers]
+
+    timings = {}
+    for name, future in futures:
+        if future.exception() is None:
+            timings[name] = future.result()
+            stamp("Writer", name, "finished in", format(timings[name], ".2f"), "seconds")
+        else:
+            stamp("Writer", name, "failed:", future.exception())
+
+    stamp("Output stage finished in", format(time.time() - start, ".2f"), "seconds")
+
+    for name, future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+
+    return timings
+
+
+def _get_json(value):
+
+    """ JSON value of calls decoded lazily from the genotype codes (CallRow), which are written as lists. """
+
+    if isinstance(value, CallRow):
+        return value.tolist()
+
+    raise TypeError(repr(value) + " is not JSON serializable")
+
+
+def write_fasta(records, file, line_width=60, buffer_size=2 ** 20):
+
+    """
+    Stream records of (ID, sequence) to a fasta file through a large write buffer without creating sequence objects,
+    sequences are wrapped at line width (None to not wrap), returns number of records written.
+
+    """
+
+    count = 0
+
+    with open(file, "w", buffering=buffer_size) as fasta_file:
+        write = fasta_file.write
+        for seq_id, seq in records:
+            if line_width and len(seq) > line_width:
+                seq = "\n".join([seq[i:i + line_width] for i in range(0, len(seq), line_width)])
+            write(">" + seq_id + "\n" + seq + "\n")
+            count += 1
+
+    return count
 
 
 class DartWriter:
@@ -15,6 +191,10 @@ class DartWriter:
 
         self.decoding_scheme = dict()
 
+        self.matrix = None  # Genotype matrix shared by writers
+        self.matrix_index = {}
+        self.matrix_lock = threading.Lock()
+
         self.set_encoding()
 
     def set_encoding(self, homozygous_major=("A", "A"), homozygous_minor=("B", "B"), heterozygous=("A", "B"),
@@ -22,19 +202,41 @@ class DartWriter:
 
         self.decoding_scheme = {"-": missing, "0": heterozygous, "1": homozygous_minor, "2": homozygous_major}
 
-    def write_plink(self, file_name, sep="\t", remove_space=False):
+    def get_matrix(self, snps=None):
+
+        """
+        Genotype matrix of the data, encoded once and shared by all writers (also across threads of write_concurrent),
+        with rows in order of snps if given.
+
+        """
+
+        with self.matrix_lock:
+            if self.matrix is None:
+                self.matrix = GenotypeMatrix(self.data, self.attributes)
+                self.matrix_index = {snp: i for i, snp in enumerate(self.matrix.snps)}
+
+        if snps is None or snps == self.matrix.snps:
+            return self.matrix
+
+        return self.matrix.select(snps=[self.matrix_index[snp] for snp in snps])
+
+    def write_plink(self, file_name, sep="\t", remove_space=False, line_terminator="\r\n", buffer_size=2 ** 20):
+
+        """
+        Write text PLINK files (.ped, .map), streaming one sample row at a time from the encoded genotype matrix
+        through a CSV writer (fields with delimiter, quotes or line breaks are quoted). Genotype codes are translated
+        to alleles through a table of the decoding scheme, so that only the encoded matrix and one output row are held
+        in memory.
+
+        """
 
         snp_order = sorted(self.data.keys())
 
-        stamp("Decoding calls...")
-        snp_rows = [[self.decoding_scheme[snp] for snp in self.data[snp_id]["calls"]] for snp_id in snp_order]
+        matrix = self.get_matrix(snps=snp_order)
 
         # Update to output actual ACGT values for alleles rather than just A or B - this maintains the most info.
 
-        stamp("Transposing calls...")
-        snps_by_sample = numpy.asarray(snp_rows).transpose(1, 0, 2)
-
-        genotypes = [sample.flatten().tolist() for sample in snps_by_sample]
+        table = numpy.array([self.decoding_scheme[symbol] for symbol in matrix.symbols], dtype=object)
 
         names = self.attributes["sample_names"]
         pops = [self.attributes["pops"][sample] for sample in names]
@@ -46,37 +248,265 @@ class DartWriter:
         ped_file = os.path.join(self.attributes["out_path"], file_name + '.ped')
         map_file = os.path.join(self.attributes["out_path"], file_name + '.map')
 
-        paternal = ["0"] * len(names)
-        maternal = ["0"] * len(names)
-        sex = ["0"] * len(names)
-        phenotype = ["-9"] * len(names)
-
-        plink = zip(pops, names, paternal, maternal, sex, phenotype, genotypes)
-
-        stamp("Formatting calls...")
-
-        ped_data = []
-        for row in plink:
-            new_row = list(row[:6])
-            for geno in row[6]:
-                new_row.append(geno)
-            ped_data.append(new_row)
-
         stamp("Writing PLINK")
         stamp("PED file:", ped_file)
         stamp("MAP file:", map_file)
 
-        with open(ped_file, 'w') as ped_out:
-            ped_writer = csv.writer(ped_out, delimiter=sep)
-            ped_writer.writerows(ped_data)
+        # Sample-major view of the matrix for rows of the PED:
+        samples = matrix.codes.T
+
+        with open(ped_file, 'w', buffering=buffer_size, newline="") as ped_out:
+            ped_writer = csv.writer(ped_out, delimiter=sep, lineterminator=line_terminator)
+            for i, (pop, name) in enumerate(zip(pops, names)):
+                ped_writer.writerow([pop, name, "0", "0", "0", "-9"] + table[samples[i]].ravel().tolist())
 
         # MAP Formatting
 
-        map_data = [["0", snp_id, "0", "0"] for snp_id in snp_order]
+        with open(map_file, 'w', buffering=buffer_size, newline="") as map_out:
+            map_writer = csv.writer(map_out, delimiter=sep, lineterminator=line_terminator)
+            map_writer.writerows(["0", snp_id, "0", "0"] for snp_id in snp_order)
+
+        return ped_file
+
+    def write_plink_bed(self, file_name, sep="\t", remove_space=False, block_size=4096):
+
+        """
+        Write binary PLINK files (.bed, .bim, .fam) from the encoded genotype matrix. The .bed is written in SNP-major
+        mode with 2 bits per call, packed for blocks of SNPs without decoding calls. Alleles are A (major) and B
+        (minor) as in the text PED, with B as allele 1 in the .bim.
+
+        """
+
+        snp_order = sorted(self.data.keys())
+
+        matrix = self.get_matrix(snps=snp_order)
+
+        bed_file = os.path.join(self.attributes["out_path"], file_name + '.bed')
+        bim_file = os.path.join(self.attributes["out_path"], file_name + '.bim')
+        fam_file = os.path.join(self.attributes["out_path"], file_name + '.fam')
 
-        with open(map_file, 'w') as map_out:
-            ped_writer = csv.writer(map_out, delimiter=sep)
-            ped_writer.writerows(map_data)
+        stamp("Writing binary PLINK")
+        stamp("BED file:", bed_file)
+        stamp("BIM file:", bim_file)
+        stamp("FAM file:", fam_file)
+
+        n_samples = matrix.codes.shape[1]
+        n_bytes = (n_samples + 3) // 4
+
+        with open(bed_file, "wb") as bed_out:
+            bed_out.write(BED_MAGIC)
+
+            for start in range(0, len(snp_order), block_size):
+                block = numpy.full((min(block_size, len(snp_order) - start), n_bytes * 4), 0, dtype=numpy.uint8)
+                block[:, :n_samples] = BED_CODES[matrix.codes[start:start + block_size]]
+
+                block = block.reshape(block.shape[0], n_bytes, 4)
+                packed = block[:, :, 0] | (block[:, :, 1] << 2) | (block[:, :, 2] << 4) | (block[:, :, 3] << 6)
+
+                bed_out.write(packed.tobytes())
+
+        with open(bim_file, "w") as bim_out:
+            bim_writer = csv.writer(bim_out, delimiter=sep, lineterminator="\n")
+            bim_writer.writerows([["0", snp_id, "0", "0", "B", "A"] for snp_id in snp_order])
+
+        names = self.attributes["sample_names"]
+        pops = [self.attributes["pops"][sample] for sample in names]
+
+        if remove_space:
+            names = ["_".join(name.split()) for name in names]
+            pops = ["_".join(pop.split()) for pop in pops]
+
+        with open(fam_file, "w") as fam_out:
+            fam_writer = csv.writer(fam_out, delimiter=sep, lineterminator="\n")
+            fam_writer.writerows([[pop, name, "0", "0", "0", "-9"] for pop, name in zip(pops, names)])
+
+        return bed_file
+
+    def write_vcf(self, file_name, counts=None, compress=False, threads=1, block_size=1024, remove_space=False,
+                  buffer_size=2 ** 20):
+
+        """
+        Write the data as VCF (.vcf or block-gzip .vcf.gz), streaming blocks of SNP records from the encoded genotype
+        matrix. Genotypes are translated through a table of VCF genotypes for each code; with read counts (tuple of
+        SNP IDs, sample names and array of SNPs x samples x (reference, alternative) counts as from
+        Preprocessor.get_counts) the depth (DP) and allelic depths (AD) are added to each call.
+
+        Records are ordered by CloneID (CHROM) and position of the SNP in the allele sequence (POS, 1-based), reference
+        and alternative alleles are taken from the SNP column of DArT (e.g. 12:A>G). With compress, blocks of the
+        output are compressed across threads.
+
+        """
+
+        variants = {snp_id: self._get_variant(snp_id, entry) for snp_id, entry in self.data.items()}
+        snp_order = sorted(variants.keys(), key=lambda snp_id: (variants[snp_id][0], variants[snp_id][1], snp_id))
+
+        matrix = self.get_matrix(snps=snp_order)
+
+        names = self.attributes["sample_names"]
+        if remove_space:
+            names = ["_".join(name.split()) for name in names]
+
+        if counts is not None:
+            rows, columns = self._get_count_index(counts, snp_order, self.attributes["sample_names"])
+            counts = counts[2]
+            sample_format = "GT:DP:AD"
+        else:
+            sample_format = "GT"
+
+        vcf_file = os.path.join(self.attributes["out_path"], file_name + (".vcf.gz" if compress else ".vcf"))
+
+        stamp("Writing VCF")
+        stamp("VCF file:", vcf_file)
+
+        if compress:
+            vcf_out = BlockGzipWriter(vcf_file, threads=threads)
+        else:
+            vcf_out = open(vcf_file, "w", buffering=buffer_size)
+
+        with vcf_out:
+            vcf_out.write("##fileformat=VCFv4.2\n##source=DartQC\n")
+            vcf_out.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+            if sample_format != "GT":
+                vcf_out.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth summed over '
+                              'replicates">\n')
+                vcf_out.write('##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Read depth of reference and '
+                              'alternative allele summed over replicates">\n')
+
+            vcf_out.write("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + names)
+                          + "\n")
+
+            for start in range(0, len(snp_order), block_size):
+                calls = VCF_GENOTYPES[matrix.codes[start:start + block_size]]
+
+                if sample_format != "GT":
+                    block = counts[rows[start:start + block_size]][:, columns]
+                    ref, alt = block[:, :, 0].astype(str).astype(object), block[:, :, 1].astype(str).astype(object)
+                    depth = (block[:, :, 0] + block[:, :, 1]).astype(str).astype(object)
+                    calls = calls + ":" + depth + ":" + ref + "," + alt
+
+                lines = []
+                for snp_id, row in zip(snp_order[start:start + block_size], calls):
+                    chrom, pos, ref_allele, alt_allele = variants[snp_id]
+                    lines.append("\t".join([chrom, str(pos), snp_id, ref_allele, alt_allele, ".", "PASS", ".",
+                                            sample_format] + row.tolist()) + "\n")
+
+                vcf_out.write("".join(lines))
+
+        return vcf_file
+
+    @staticmethod
+    def _get_variant(snp_id, entry):
+
+        """ CHROM, POS, REF and ALT of a SNP from CloneID and SNP column, REF N and ALT . if not in SNP column. """
+
+        chrom = entry.get("clone_id") or snp_id
+
+        match = VCF_SNP.match(entry.get("snp") or "")
+        if match:
+            return chrom, int(match.group(1)) + 1, match.group(2).upper(), match.group(3).upper()
+
+        return chrom, 1, "N", "."
+
+    @staticmethod
+    def _get_count_index(counts, snps, samples):
+
+        """ Row and column indices of SNPs and samples in read counts (SNP IDs, sample names, array). """
+
+        count_snps = {snp: i for i, snp in enumerate(counts[0])}
+        count_samples = {sample: i for i, sample in enumerate(counts[1])}
+
+        missing = [snp for snp in snps if snp not in count_snps] + \
+                  [sample for sample in samples if sample not in count_samples]
+
+        if missing:
+            raise ValueError("Read counts missing for SNPs or samples: " + ", ".join(missing[:5]))
+
+        return numpy.array([count_snps[snp] for snp in snps], dtype=int), \
+            numpy.array([count_samples[sample] for sample in samples], dtype=int)
+
+    def write_store(self, file_name, counts=None):
+
+        """
+        Write the data to a binary columnar project store (directory <file_name>_store) for DartReader.read_store:
+
+            genotypes.npy       encoded genotype matrix (SNPs x samples, uint8 codes of GenotypeMatrix), memory-mappable
+            snps.npy            SNP index (row order of the genotype matrix)
+            samples.npy         sample index (column order of the genotype matrix)
+            columns/<key>.npy   one array per SNP field (statistics, sequences, IDs) in order of the SNP index
+            store.json          version, shape and type of each column
+            attributes.json     attributes sidecar
+            counts.npy          read counts (SNPs x samples x (reference, alternative)), if counts are given
+
+        """
+
+        store_path = os.path.abspath(os.path.join(self.attributes["out_path"], file_name + "_store"))
+        column_path = os.path.join(store_path, "columns")
+
+        stamp("Writing data to binary project store")
+        stamp("Store:", store_path)
+
+        os.makedirs(column_path, exist_ok=True)
+
+        snps = list(self.data.keys())
+
+        matrix = self.get_matrix(snps=snps)
+
+        numpy.save(os.path.join(store_path, "genotypes.npy"), matrix.codes)
+        numpy.save(os.path.join(store_path, "snps.npy"), numpy.array(snps, dtype=str))
+        numpy.save(os.path.join(store_path, "samples.npy"), numpy.array(self.attributes["sample_names"], dtype=str))
+
+        if counts is not None:
+            rows, columns = self._get_count_index(counts, snps, self.attributes["sample_names"])
+            numpy.save(os.path.join(store_path, "counts.npy"), counts[2][rows][:, columns])
+        elif os.path.exists(os.path.join(store_path, "counts.npy")):
+            os.remove(os.path.join(store_path, "counts.npy"))
+
+        keys = []
+        for entry in self.data.values():
+            keys += [key for key in entry.keys() if key != "calls" and key not in keys]
+
+        columns = {}
+        for key in keys:
+            values = [entry.get(key) for entry in self.data.values()]
+            column, columns[key] = self._get_column(values)
+            numpy.save(os.path.join(column_path, key + ".npy"), column)
+
+        with open(os.path.join(store_path, "store.json"), "w") as store_out:
+            json.dump({"version": STORE_VERSION, "shape": list(matrix.codes.shape), "columns": columns}, store_out,
+                      indent=4)
+
+        with open(os.path.join(store_path, "attributes.json"), "w") as attr_out:
+            json.dump(self.attributes, attr_out, indent=4)
+
+        return store_path
+
+    @staticmethod
+    def _get_column(values):
+
+        """
+        Array of SNP field values and column type: bool, int, float, nullable (float with missing values as NaN), str
+        or json (encoded strings for other values such as dictionaries of population statistics).
+
+        """
+
+        if all(isinstance(value, bool) for value in values):
+            return numpy.array(values, dtype=bool), "bool"
+
+        numbers = [value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+                   for value in values]
+
+        if all(numbers):
+            if all(isinstance(value, int) for value in values):
+                return numpy.array(values, dtype=numpy.int64), "int"
+            if any(value is None for value in values):
+                column = numpy.array([numpy.nan if value is None else value for value in values], dtype=float)
+                return column, "nullable"
+            return numpy.array(values, dtype=float), "float"
+
+        if all(isinstance(value, str) for value in values):
+            return numpy.array(values, dtype=str), "str"
+
+        return numpy.array([json.dumps(value) for value in values], dtype=str), "json"
 
     def write_json(self, file_name, data_indent=0, attribute_indent=4):
 
@@ -88,7 +518,36 @@ class DartWriter:
         stamp("Attribute file:", attribute_file)
 
         with open(data_file, "w") as data_out:
-            json.dump(self.data, data_out, indent=data_indent)
+            json.dump(self.data, data_out, indent=data_indent, default=_get_json)
 
         with open(attribute_file, "w") as attr_out:
             json.dump(self.attributes, attr_out, indent=attribute_indent)
+
+    def write_ndjson(self, file_name, batch_size=10000, buffer_size=2 ** 20):
+
+        """
+        Write data as line-delimited JSON (<file_name>_data.ndjson) for DartReader.read_ndjson: a header line with
+        version and attributes, then one line for each SNP with its ID and data, written in batches of lines.
+
+        """
+
+        data_file = os.path.abspath(os.path.join(self.attributes["out_path"], file_name + "_data.ndjson"))
+
+        stamp("Writing data to line-delimited JSON")
+        stamp("Data file:", data_file)
+
+        with open(data_file, "w", buffering=buffer_size) as data_out:
+            data_out.write(json.dumps({"version": NDJSON_VERSION, "attributes": self.attributes}) + "\n")
+
+            lines = []
+            for snp_id, entry in self.data.items():
+                lines.append(json.dumps({"id": snp_id, "data": entry}, default=_get_json))
+
+                if len(lines) >= batch_size:
+                    data_out.write("\n".join(lines) + "\n")
+                    lines = []
+
+            if lines:
+                data_out.write("\n".join(lines) + "\n")
+
+        return data_file
@@ -0,0 +1,16 @@
+import importlib.machinery
+import importlib.util
+import os
+
+
+def load_cli():
+
+    """ Command line script bin/dartqc as module. """
+
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "dartqc")
+
+    loader = importlib.machinery.SourceFileLoader("dartqc_cli", path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(module)
+
+    return module
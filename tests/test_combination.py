@@ -0,0 +1,66 @@
+import itertools
+import random
+import types
+import unittest
+
+import numpy
+
+from dartqc.DartModules import CombinationModule
+
+
+def make_module(**statistics):
+
+    """ Stand-in for SNPModule with the given statistics for each SNP. """
+
+    snps = len(next(iter(statistics.values())))
+
+    data = {"snp" + str(i): {parameter: values[i] for parameter, values in statistics.items()} for i in range(snps)}
+
+    return types.SimpleNamespace(data=data)
+
+
+def count_retained(data, parameters, combination, comparisons):
+
+    """ Retained SNPs for one combination of thresholds, in the same way as SNPModule.filter_data. """
+
+    compare = {"<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b, "==": lambda a, b: a == b}
+
+    return sum(1 for entry in data.values()
+               if not any(threshold is not None and compare[comparison](entry[parameter], threshold)
+                          for parameter, threshold, comparison in zip(parameters, combination, comparisons)))
+
+
+class TestCombinationCube(unittest.TestCase):
+
+    def test_undefined_statistic(self):
+
+        cm = CombinationModule(make_module(fis=[float("nan"), 0.1, 0.5]))
+
+        numpy.testing.assert_array_equal(cm.get_cube(["fis"], [[None, 0.3]], comparisons=[">="]), [3, 2])
+        numpy.testing.assert_array_equal(cm.get_cube(["fis"], [[None, 0.3]], comparisons=["<="]), [3, 2])
+        numpy.testing.assert_array_equal(cm.get_cube(["fis"], [[None, 0.1]], comparisons=["=="]), [3, 2])
+
+    def test_filter_parity(self):
+
+        random_state = random.Random(20170101)
+
+        maf = [random_state.choice([0.0, 0.05, 0.1, 0.2, 0.5]) for _ in range(200)]
+        fis = [random_state.choice([float("nan"), -0.5, 0.0, 0.1, 0.3, 1.0]) for _ in range(200)]
+
+        module = make_module(maf=maf, fis=fis)
+        cm = CombinationModule(module)
+
+        parameters = ["maf", "fis"]
+        values = [[0.1, None, 0.0, 0.1, 0.3], [0.3, -0.5, None, 1.0]]
+
+        for comparisons in itertools.product(["<=", ">=", "=="], repeat=2):
+            cube = cm.get_cube(parameters, values, comparisons=list(comparisons))
+
+            for index in numpy.ndindex(*cube.shape):
+                combination = [parameter_values[i] for parameter_values, i in zip(values, index)]
+                self.assertEqual(cube[index], count_retained(module.data, parameters, combination, comparisons),
+                                 msg=str(comparisons) + " " + str(combination))
+
+
+if __name__ == "__main__":
+    unittest.main()
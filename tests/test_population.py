@@ -0,0 +1,96 @@
+import math
+import unittest
+
+from dartqc.DartModules import PopulationModule
+
+
+def make_data(snps):
+
+    """ Data and attributes for populations A, B, ... with calls of each SNP given as one string per population. """
+
+    sizes = [len(calls) for calls in next(iter(snps.values()))]
+    names = [pop + str(i) for pop, size in zip("ABCDEFGH", sizes) for i in range(size)]
+
+    attributes = {"project": "test", "sample_size": len(names), "sample_names": names,
+                  "pops": {name: name[0] for name in names}, "missing": "-", "heterozygous": "0",
+                  "homozygous_minor": "1", "homozygous_major": "2", "out_path": ".", "snps": len(snps), "modules": {}}
+
+    data = {snp: {"calls": [call for pop_calls in calls for call in pop_calls]} for snp, calls in snps.items()}
+
+    return data, attributes
+
+
+HWE = "111" + "0000" + "222"  # In HWE (p = 0.5, 3 : 4 : 3)
+NO_HET = "11111" + "22222"  # Deficit of heterozygotes, fails HWE
+
+
+class TestPopulationHWE(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data, self.attributes = make_data({
+            "monomorphic": ["2" * 10, HWE, HWE],
+            "missing": ["-" * 10, HWE, HWE],
+            "failing": [HWE, NO_HET, NO_HET]
+        })
+
+    def test_undefined_hwe(self):
+
+        pm = PopulationModule(self.data, self.attributes)
+        pm.calculate_statistics()
+
+        self.assertIsNone(self.data["monomorphic"]["pop_hwe"]["A"])
+        self.assertIsNone(self.data["missing"]["pop_hwe"]["A"])
+        self.assertGreater(self.data["monomorphic"]["pop_hwe"]["B"], 0.05)
+
+        row = pm.statistics_snps.index("monomorphic")
+        self.assertTrue(math.isnan(pm.statistics["hwe"][row, 0]))
+
+    def test_monomorphic_population_does_not_fail(self):
+
+        pm = PopulationModule(self.data, self.attributes)
+        data, attributes = pm.filter_populations(0.05, parameter="hwe", populations=1)
+
+        self.assertEqual(set(data.keys()), {"monomorphic", "missing"})
+        self.assertEqual(attributes["modules"]["population"]["results"]["stratified"]["removed"], 1)
+
+    def test_failing_populations(self):
+
+        pm = PopulationModule(self.data, self.attributes)
+        data, attributes = pm.filter_populations(0.05, parameter="hwe", populations=3)
+
+        self.assertEqual(len(data), 3)
+
+
+class TestPopulationFst(unittest.TestCase):
+
+    """ Weir & Cockerham (1984) Fst, expected values computed by hand from the variance components. """
+
+    def setUp(self):
+
+        self.data, self.attributes = make_data({
+            "differentiated": ["1100", "2220"],  # p = 0.75, 0.125: a = 17/96, b = -1/48, c = 3/16
+            "identical": ["0022", "0022"]  # p = 0.25, 0.25: a = -1/48, b = -1/24, c = 1/4
+        })
+
+    def test_snp_fst(self):
+
+        pm = PopulationModule(self.data, self.attributes)
+        pm.calculate_fst()
+
+        self.assertAlmostEqual(self.data["differentiated"]["fst"], 17 / 33)
+        self.assertAlmostEqual(self.data["identical"]["fst"], -1 / 9)
+
+    def test_pairwise_fst(self):
+
+        pm = PopulationModule(self.data, self.attributes)
+        fst = pm.calculate_fst()
+
+        # Ratio of variance components summed across SNPs: (17/96 - 2/96) / (33/96 + 18/96)
+        self.assertAlmostEqual(fst[0, 1], 5 / 17)
+        self.assertAlmostEqual(fst[1, 0], 5 / 17)
+        self.assertEqual(fst[0, 0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
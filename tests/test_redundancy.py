@@ -0,0 +1,90 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from dartqc.DartModules import RedundancyModule
+
+
+def make_sequences(seed=20170101):
+
+    """ Sequences of 40 clones with one or two variants each and some identical sequences. """
+
+    random_state = random.Random(seed)
+
+    sequences = {}
+    for clone in range(40):
+        sequence = "".join(random_state.choice("ACGT") for _ in range(69))
+        sequences["clone" + str(clone) + "a"] = sequence
+
+        if clone % 2 == 0:
+            position = random_state.randrange(69)
+            sequences["clone" + str(clone) + "b"] = sequence[:position] + \
+                ("A" if sequence[position] != "A" else "C") + sequence[position + 1:]
+
+        if clone % 5 == 0:
+            sequences["clone" + str(clone) + "c"] = sequence
+
+    return sequences
+
+
+class TestClusterCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.out_path = tempfile.mkdtemp()
+        self.attributes = {"project": "test", "sample_size": 0, "sample_names": [], "missing": "-",
+                           "heterozygous": "0", "homozygous_minor": "1", "homozygous_major": "2",
+                           "out_path": self.out_path, "modules": {}}
+
+        self.sequences = make_sequences()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.out_path)
+
+    def cluster(self, sequences, cache=True):
+
+        rm = RedundancyModule({}, dict(self.attributes, modules={}), cache=cache)
+
+        return rm.cluster_sequences(sequences, identity=0.95, engine="kmer"), rm
+
+    def test_exact(self):
+
+        clusters, rm = self.cluster(self.sequences)
+
+        self.assertEqual(len(os.listdir(rm.cache_path)), 1)
+        self.assertEqual(rm._read_cluster_cache(self.sequences, identity=0.95, engine="kmer"), clusters)
+
+        # Other parameters are not read from cache:
+        self.assertIsNone(rm._read_cluster_cache(self.sequences, identity=0.9, engine="kmer"))
+
+    def test_superset(self):
+
+        clusters, rm = self.cluster(self.sequences)
+        self.assertTrue(clusters)
+
+        subset = {snp_id: sequence for snp_id, sequence in self.sequences.items() if not snp_id.endswith("c")}
+
+        self.assertEqual(rm._read_cluster_cache(subset, identity=0.95, engine="kmer"),
+                         RedundancyModule._restrict_clusters(clusters, subset))
+
+        # A subset does not add a cache entry:
+        self.cluster(subset)
+        self.assertEqual(len(os.listdir(rm.cache_path)), 1)
+
+        # Different sequences of the same IDs are not a subset:
+        changed = dict(subset, clone0a=subset["clone0a"][::-1])
+        self.assertIsNone(rm._read_cluster_cache(changed, identity=0.95, engine="kmer"))
+
+    def test_disabled(self):
+
+        _, rm = self.cluster(self.sequences, cache=False)
+
+        self.assertIsNone(rm.cache_path)
+        self.assertFalse(os.path.exists(os.path.join(self.out_path, "cache")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import copy
+import random
+import shutil
+import tempfile
+import unittest
+
+from dartqc.DartModules import SampleModule, PopulationModule, IBSModule
+from tests.cli import load_cli
+
+
+def make_data(snps=50, samples=20, seed=20170101):
+
+    """ Random calls with missingness varying between samples. """
+
+    random_state = random.Random(seed)
+
+    names = ["S" + str(i) for i in range(samples)]
+    missing = [random_state.random() * 0.6 for _ in names]
+
+    data = {"snp" + str(i): {"calls": ["-" if random_state.random() < missing[j] else random_state.choice("012")
+                                       for j in range(samples)]} for i in range(snps)}
+
+    attributes = {"project": "test", "sample_size": samples, "sample_names": names,
+                  "pops": {name: "AB"[i % 2] for i, name in enumerate(names)}, "missing": "-",
+                  "heterozygous": "0", "homozygous_minor": "1", "homozygous_major": "2", "out_path": ".",
+                  "snps": snps, "modules": {}}
+
+    return data, attributes
+
+
+class TestMindSweep(unittest.TestCase):
+
+    def test_sweep_filter_parity(self):
+
+        data, attributes = make_data()
+        minds = [0.1, 0.2, 0.3, 0.5]
+
+        sweep = SampleModule(copy.deepcopy(data), copy.deepcopy(attributes)).sweep_mind(minds)
+
+        self.assertEqual([entry["value"] for entry in sweep], minds)
+
+        for entry in sweep:
+            filtered_data, filtered_attributes = SampleModule(copy.deepcopy(data), copy.deepcopy(attributes)) \
+                .filter_data(mind=entry["value"], recalculate=False)
+
+            retained = set(filtered_attributes["sample_names"])
+
+            self.assertEqual(set(entry["removed"]), set(attributes["sample_names"]) - retained)
+            self.assertEqual(entry["removed_samples"], len(entry["removed"]))
+            self.assertEqual(entry["samples"], len(retained))
+
+            calls = [call for snp in filtered_data.values() for call in snp["calls"]]
+            if calls:
+                self.assertAlmostEqual(entry["call_rate_mean"], 1 - calls.count("-") / len(calls))
+
+    def test_sweep_states(self):
+
+        data, attributes = make_data()
+
+        sm = SampleModule(data, attributes)
+        sweep = sm.sweep_mind(full=True)
+
+        states = attributes["modules"]["individual"]["states"]["mind_sweep"]
+
+        self.assertEqual(len(states["thresholds"]), len(sweep))
+
+        for entry, state in zip(sweep, states["thresholds"]):
+            self.assertEqual(list(entry["removed"]), states["order"][:state["removed_samples"]])
+
+
+class TestIBS(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data, self.attributes = make_data(snps=100, samples=30)
+        self.attributes["out_path"] = tempfile.mkdtemp()
+
+        for entry in self.data.values():
+            entry["calls"][7] = entry["calls"][3]
+
+    def tearDown(self):
+
+        shutil.rmtree(self.attributes["out_path"])
+
+    def get_expected(self, concordance, min_called):
+
+        """ Flagged pairs from comparing calls of each pair of samples. """
+
+        calls = list(zip(*[entry["calls"] for entry in self.data.values()]))
+        names = self.attributes["sample_names"]
+
+        expected = []
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                called = [(a, b) for a, b in zip(calls[i], calls[j]) if a != "-" and b != "-"]
+                identical = sum(1 for a, b in called if a == b)
+                if called and len(called) >= min_called and identical / len(called) >= concordance:
+                    expected.append((names[i], names[j], len(called), identical,
+                                     sum(1 for a, b in zip(calls[i], calls[j]) if a == b == "-")))
+
+        return sorted(expected)
+
+    def test_pairs(self):
+
+        for block_size, threads in ((32, 1), (4, 2), (7, 1)):
+            for concordance, min_called in ((0.0, 0), (0.4, 20), (0.99, 0)):
+                ibs = IBSModule(copy.deepcopy(self.data), copy.deepcopy(self.attributes), threads=threads,
+                                block_size=block_size)
+
+                pairs = ibs.get_pairs(concordance=concordance, min_called=min_called)
+
+                self.assertEqual(sorted((pair["sample_one"], pair["sample_two"], pair["called"],
+                                         int(round(pair["concordance"] * pair["called"])), pair["shared_missing"])
+                                        for pair in pairs), self.get_expected(concordance, min_called))
+
+                self.assertEqual([pair["concordance"] for pair in pairs],
+                                 sorted((pair["concordance"] for pair in pairs), reverse=True))
+
+    def test_states(self):
+
+        ibs = IBSModule(self.data, self.attributes)
+
+        data, attributes = ibs.get_data(concordance=0.99)
+        pairs_file = ibs.write_pairs()
+
+        self.assertEqual(attributes["sample_size"], 29)
+        self.assertEqual(len({"S3", "S7"} & set(attributes["sample_names"])), 1)
+        self.assertEqual(attributes["modules"]["ibs"]["states"], {"pairs": 1, "pairs_file": pairs_file})
+
+
+class TestSampleRemovalPopulations(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.cli = load_cli()
+
+    def setUp(self):
+
+        self.data, self.attributes = make_data(samples=12)
+        self.attributes["out_path"] = tempfile.mkdtemp()
+
+        # Duplicate samples S1 of S0 and S3 of S2:
+        for entry in self.data.values():
+            entry["calls"][1] = entry["calls"][0]
+            entry["calls"][3] = entry["calls"][2]
+
+        self.args = {"threads": 1, "duplicate_samples": 0.99, "mind": [0.3], "call_rate": [0.5], "pop_file": "pops.csv",
+                     "mono": "all", "mono_comp": "==", "pop_hwe": 0.0, "pop_hwe_min": 1}
+
+    def tearDown(self):
+
+        shutil.rmtree(self.attributes["out_path"])
+
+    def check_populations(self, data, attributes):
+
+        self.assertEqual(set(attributes["pops"]), set(attributes["sample_names"]))
+
+        data, attributes = self.cli._filter_monomorphic(self.args, data, attributes)
+
+        PopulationModule(data, attributes).calculate_fst()
+
+    def test_duplicate_samples(self):
+
+        data, attributes = self.cli._filter_duplicate_samples(self.args, self.data, self.attributes)
+
+        self.assertEqual(attributes["sample_size"], 10)
+        self.check_populations(data, attributes)
+
+    def test_converge(self):
+
+        data, attributes = self.cli._filter_converge(self.args, self.data, self.attributes)
+
+        self.assertLess(attributes["sample_size"], 12)
+        self.check_populations(data, attributes)
+
+    def test_mind(self):
+
+        data, attributes = self.cli._filter_mind(dict(self.args, graph=False), self.data, self.attributes)
+
+        self.assertLess(attributes["sample_size"], 12)
+        self.check_populations(data, attributes)
+
+
+if __name__ == "__main__":
+    unittest.main()
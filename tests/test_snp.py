@@ -0,0 +1,108 @@
+import copy
+import math
+import unittest
+
+from dartqc.DartModules import SNPModule
+from tests.cli import load_cli
+
+
+def make_args(**filters):
+
+    """ Arguments of the filter task for SNP filters, other filters are not set. """
+
+    args = {"maf": [], "call_rate": [], "rep": [], "hwe": [], "ho": [], "he": [], "pic": [], "fis": [],
+            "ho_comp": ">=", "he_comp": ">=", "pic_comp": "<=", "fis_comp": ">="}
+
+    args.update(filters)
+
+    return args
+
+
+def make_data():
+
+    names = ["S" + str(i) for i in range(10)]
+
+    snps = {
+        "hwe": "111" + "0000" + "222",  # Ho 0.4, He 0.5, Fis 0.2
+        "excess": "0000000" + "122",  # Excess heterozygotes, Fis < 0
+        "deficit": "11111" + "22222",  # No heterozygotes, Fis 1
+        "rare": "0" + "222222222",  # Low He and PIC
+        "monomorphic": "2222222222"
+    }
+
+    data = {snp: {"allele_id": snp, "rep_average": 1.0, "calls": list(calls)} for snp, calls in snps.items()}
+
+    attributes = {"project": "test", "sample_size": len(names), "sample_names": names, "pops": {},
+                  "missing": "-", "heterozygous": "0", "homozygous_minor": "1", "homozygous_major": "2",
+                  "out_path": ".", "snps": len(data), "modules": {}}
+
+    return data, attributes
+
+
+class TestExtendedFilters(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.cli = load_cli()
+
+    def setUp(self):
+
+        self.data, self.attributes = make_data()
+
+        # Statistics of each SNP as computed by SNPModule:
+        self.statistics = SNPModule(copy.deepcopy(self.data), copy.deepcopy(self.attributes)).data
+
+    def filter_snps(self, **filters):
+
+        all_data, all_attrs = self.cli._filter_snps(make_args(**filters), copy.deepcopy(self.data),
+                                                    copy.deepcopy(self.attributes))
+
+        return [sorted(data) for data in all_data], all_attrs
+
+    def expected(self, parameter, threshold, comparison):
+
+        compare = {"<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b, "==": lambda a, b: a == b}[comparison]
+
+        return sorted(snp for snp, entry in self.statistics.items()
+                      if math.isnan(entry[parameter]) or not compare(entry[parameter], threshold))
+
+    def test_default_comparisons(self):
+
+        for parameter, threshold in (("ho", 0.5), ("he", 0.4), ("pic", 0.2), ("fis", 0.5)):
+            comparison = make_args()[parameter + "_comp"]
+
+            retained, _ = self.filter_snps(**{parameter: [threshold]})
+
+            self.assertEqual(retained, [self.expected(parameter, threshold, comparison)], msg=parameter)
+
+        retained, _ = self.filter_snps(fis=[0.5])
+        self.assertNotIn("deficit", retained[0])
+        self.assertIn("excess", retained[0])
+
+    def test_comparisons(self):
+
+        for comparison in ("<=", ">=", "=="):
+            retained, _ = self.filter_snps(fis=[0.2], fis_comp=comparison)
+
+            self.assertEqual(retained, [self.expected("fis", 0.2, comparison)], msg=comparison)
+
+    def test_filter_sets(self):
+
+        # One filter set for each value, filters with fewer values are not set in the remaining sets:
+        retained, all_attrs = self.filter_snps(maf=[0.1, None], fis=[0.5, 0.1], he=[0.498])
+
+        first = [snp for snp in self.expected("fis", 0.5, ">=") if snp in self.expected("he", 0.498, ">=") and
+                 self.statistics[snp]["maf"] > 0.1]
+
+        self.assertEqual(first, ["excess"])
+        self.assertEqual(retained, [first, self.expected("fis", 0.1, ">=")])
+
+        # Removed SNPs of the last filter set are logged for the module summary:
+        results = all_attrs[-1]["modules"]["snp"]["results"]
+        self.assertEqual(results["fis"]["value"], 0.1)
+        self.assertEqual(results["fis"]["removed"], 5 - len(retained[-1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
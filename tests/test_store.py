@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from dartqc.DartMatrix import GenotypeMatrix, CallRow
+from dartqc.DartReader import DartReader
+from dartqc.DartWriter import DartWriter
+
+
+class TestProjectStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.out_path = tempfile.mkdtemp()
+
+        self.attributes = {"project": "test", "sample_size": 4, "sample_names": ["A", "B", "C", "D"],
+                           "pops": {"A": "P", "B": "P", "C": "Q", "D": "Q"}, "missing": "-", "heterozygous": "0",
+                           "homozygous_minor": "1", "homozygous_major": "2", "out_path": self.out_path, "snps": 3,
+                           "modules": {}}
+
+        self.data = {"snp1": {"allele_id": "snp1", "rep_average": 0.9, "calls": ["0", "1", "2", "-"]},
+                     "snp2": {"allele_id": "snp2", "rep_average": 1.0, "calls": ["2", "2", "-", "-"]},
+                     "snp3": {"allele_id": "snp3", "rep_average": 0.8, "calls": ["1", "0", "0", "2"]}}
+
+        store_path = DartWriter(self.data, self.attributes).write_store("test")
+
+        self.store_data, self.store_attributes = DartReader().read_store(store_path)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.out_path)
+
+    def test_calls(self):
+
+        for snp, entry in self.data.items():
+            calls = self.store_data[snp]["calls"]
+
+            self.assertIsInstance(calls, CallRow)
+            self.assertEqual(calls, entry["calls"])
+            self.assertEqual(list(calls), entry["calls"])
+            self.assertEqual(calls[1:3], entry["calls"][1:3])
+            self.assertEqual(calls.count("-"), entry["calls"].count("-"))
+
+        self.assertEqual(self.store_data["snp1"]["rep_average"], 0.9)
+
+    def test_matrix(self):
+
+        matrix = GenotypeMatrix(self.data, self.attributes)
+        store_matrix = GenotypeMatrix(self.store_data, self.store_attributes)
+
+        numpy.testing.assert_array_equal(store_matrix.codes, matrix.codes)
+
+        # Calls are recoded for matrices with other symbols in the same way as lists of calls:
+        attributes = dict(self.store_attributes, heterozygous="1", homozygous_minor="2", homozygous_major="0")
+        numpy.testing.assert_array_equal(GenotypeMatrix(self.store_data, attributes).codes,
+                                         GenotypeMatrix(self.data, attributes).codes)
+
+    def test_json(self):
+
+        DartWriter(self.store_data, self.store_attributes).write_json("test")
+
+        with open(os.path.join(self.out_path, "test_data.json")) as data_file:
+            self.assertEqual(json.load(data_file)["snp3"]["calls"], self.data["snp3"]["calls"])
+
+
+if __name__ == "__main__":
+    unittest.main()
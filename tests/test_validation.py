@@ -0,0 +1,95 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from dartqc.DartClustering import reverse_complement
+from dartqc.DartFileValidation import DartFileValidator
+
+random_state = random.Random(20170101)
+
+SEQUENCES = ["".join(random_state.choice("ACGT") for _ in range(length)) for length in (69, 69, 80, 60)]
+
+OFFICIAL = [
+    ("1000001|F|0-20:A>G-20:A>G", SEQUENCES[0]),
+    ("1000002|F|0-15:C>T-15:C>T", SEQUENCES[1]),
+    ("1000003|F|0-30:G>A-30:G>A", SEQUENCES[2]),
+    ("1000004|F|0-10:T>C-10:T>C", SEQUENCES[3])
+]
+
+DATA = [
+    ("1000001|F|0-20:A>G-20:A>G", SEQUENCES[0]),  # Identical
+    ("1000009|F|0-15:C>T-15:C>T", SEQUENCES[1]),  # Other clone ID
+    ("1000002|F|0-44:A>G-44:A>G", reverse_complement(SEQUENCES[1])),  # Other position, reverse strand
+    ("1000003|F|0-30:G>A-30:G>T", SEQUENCES[2][5:74]),  # Contained, name differs after description length
+    ("1000005|F|0-12:A>G-12:A>G", SEQUENCES[3] + "ACGTACGTAC"),  # Longer than official sequence
+    ("1000006|F|0-12:A>G-12:A>G", SEQUENCES[0][:30] + ("A" if SEQUENCES[0][30] != "A" else "C") +
+     SEQUENCES[0][31:])  # Substitution, below 99% identity
+]
+
+# Clusters of the sequences as written by cd-hit-est-2d -c 0.99 -d 25:
+CLUSTERS = """>Cluster 0
+0	69nt, >1000001|F|0-20:A>G-20:A>... *
+1	69nt, >1000001|F|0-20:A>G-20:A>... at +/100.00%
+>Cluster 1
+0	69nt, >1000002|F|0-15:C>T-15:C>... *
+1	69nt, >1000009|F|0-15:C>T-15:C>... at +/100.00%
+2	69nt, >1000002|F|0-44:A>G-44:A>... at -/100.00%
+>Cluster 2
+0	80nt, >1000003|F|0-30:G>A-30:G>... *
+1	69nt, >1000003|F|0-30:G>A-30:G>... at +/100.00%
+>Cluster 3
+0	60nt, >1000004|F|0-10:T>C-10:T>... *
+"""
+
+
+class TestSequenceValidation(unittest.TestCase):
+
+    def setUp(self):
+
+        self.out_path = tempfile.mkdtemp()
+
+        self.ids_file = os.path.join(self.out_path, "id_list.csv")
+        with open(self.ids_file, "w") as ids_file:
+            ids_file.write("CloneID,AlleleSequence\n")
+            ids_file.writelines(name + "," + seq + "\n" for name, seq in OFFICIAL)
+
+        data = {name: {"allele_id": name, "clone_id": name.partition("-")[0], "allele_seq_ref": seq}
+                for name, seq in DATA}
+
+        attributes = {"project": "test", "out_path": self.out_path, "args": {"cdhit_path": None}}
+
+        self.validator = DartFileValidator(data, attributes, None, self.ids_file)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.out_path)
+
+    def get_classes(self, clusters):
+
+        self.validator.validate_sequences(clusters)
+
+        return [(cluster["ref_seq_str"], sorted(cluster["sequences"])) for cluster in self.validator.seq_vals], \
+            self.validator.seq_renames
+
+    def test_cdhit_classes(self):
+
+        self.validator.cluster_path = os.path.join(self.out_path, "test_clustered.fasta.clstr")
+        with open(self.validator.cluster_path, "w") as clstr_file:
+            clstr_file.write(CLUSTERS)
+
+        cdhit_classes = self.get_classes(self.validator.parse_clusters())
+        kmer_classes = self.get_classes(self.validator.match())
+
+        self.assertEqual(kmer_classes, cdhit_classes)
+
+        classes = dict(cdhit_classes[0])
+        self.assertEqual(classes[">1000002|F|0--15:C>T-15:C>"], [["BAD ID", ">1000009|F|0--15:C>T-15:C>"],
+                                                                 ["BAD LOC", ">1000002|F|0--44:A>G-44:A>"]])
+        self.assertEqual(classes[">1000003|F|0--30:G>A-30:G>"], [["GOOD", ">1000003|F|0--30:G>A-30:G>"]])
+        self.assertEqual(classes[">1000004|F|0--10:T>C-10:T>"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()